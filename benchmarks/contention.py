@@ -0,0 +1,148 @@
+"""Concurrent writers and readers against one SQLite file, per storage profile.
+
+    python -m benchmarks.contention --writers 4 --readers 2 --requests 200
+
+Each writer process logs all of its user's habits for a random day through
+POST /habits/log, one transaction per request, while reader processes fetch
+/analytics/data for random ranges. Every profile runs on a fresh database and
+reports throughput, latency and failed requests ("database is locked").
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+from datetime import date, timedelta
+
+# 'stock' is SQLite as it behaved before the storage profile: rollback journal,
+# full fsync, a new connection per checkout and no separate readers
+PROFILES = {
+    'stock': {'SQLITE_PRAGMAS': {}, 'SQLITE_READER_POOL_SIZE': 0},
+    'tuned': {}
+}
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 3)
+
+def _app(path, profile):
+    from waweza import create_app
+    return create_app(dict(PROFILES[profile], SQLALCHEMY_DATABASE_URI='sqlite:///' + path,
+                           SECRET_KEY='benchmark', WTF_CSRF_ENABLED=False, SQLALCHEMY_RECORD_QUERIES=False))
+
+def _worker(role, path, profile, user_id, habit_ids, requests, seed, barrier, results):
+    app = _app(path, profile)
+    rng = random.Random(seed)
+    today = date.today()
+    timings, errors = [], 0
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        barrier.wait()
+        started = time.perf_counter()
+        for _ in range(requests):
+            if role == 'writer':
+                day = today - timedelta(days=rng.randrange(365))
+                send = lambda: client.post('/habits/log', json={
+                    'habit_ids': habit_ids, 'days': [day.isoformat()], 'completed': rng.random() < 0.7})
+            else:
+                start = today - timedelta(days=rng.randrange(30, 365))
+                send = lambda: client.get(f'/analytics/data?start={start}&end={start + timedelta(days=rng.randrange(7, 90))}')
+            t = time.perf_counter()
+            try:
+                response = send()
+                ok = response.status_code == 200
+            except Exception:
+                ok = False
+            if ok:
+                timings.append((time.perf_counter() - t) * 1000)
+            else:
+                errors += 1
+        elapsed = time.perf_counter() - started
+    results.put({'role': role, 'timings': timings, 'errors': errors, 'elapsed': elapsed})
+
+def run_profile(profile, writers, readers, requests, seed):
+    from waweza import db
+    from waweza.models import Habit
+    from benchmarks.datagen import generate
+
+    fd, path = tempfile.mkstemp(prefix=f'waweza-contention-{profile}-', suffix='.db')
+    os.close(fd)
+    app = _app(path, profile)
+    with app.app_context():
+        db.create_all()
+        user_ids = generate(users=writers + readers, goals=2, habits=5, days=365, seed=seed)
+        habits = {user_id: [habit_id for habit_id, in db.session.query(Habit.id).filter(Habit.user_id == user_id)]
+                  for user_id in user_ids}
+        db.session.remove()
+        db.engine.dispose()
+
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(writers + readers)
+    results = ctx.Queue()
+    processes = []
+    for n, user_id in enumerate(user_ids):
+        role = 'writer' if n < writers else 'reader'
+        process = ctx.Process(target=_worker, args=(role, path, profile, user_id, habits[user_id],
+                                                    requests, seed + n, barrier, results))
+        process.start()
+        processes.append(process)
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    report = {'profile': profile}
+    for role in ('writer', 'reader'):
+        mine = [outcome for outcome in outcomes if outcome['role'] == role]
+        if not mine:
+            continue
+        timings = [t for outcome in mine for t in outcome['timings']]
+        elapsed = max(outcome['elapsed'] for outcome in mine)
+        report[role] = {
+            'processes': len(mine),
+            'ok': len(timings),
+            'errors': sum(outcome['errors'] for outcome in mine),
+            'per_second': round(len(timings) / elapsed, 1),
+            'p50_ms': _percentile(timings, 50),
+            'p95_ms': _percentile(timings, 95),
+            'max_ms': round(max(timings), 3) if timings else None
+        }
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure SQLite write contention per storage profile.')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per process.')
+    parser.add_argument('--profiles', default=','.join(PROFILES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=argparse.FileType('w'), default=None)
+    args = parser.parse_args(argv)
+
+    reports = []
+    for profile in args.profiles.split(','):
+        if profile not in PROFILES:
+            parser.error(f'unknown profile {profile}')
+        report = run_profile(profile, args.writers, args.readers, args.requests, args.seed)
+        reports.append(report)
+        for role in ('writer', 'reader'):
+            if role in report:
+                r = report[role]
+                print(f"{profile:>6} {role:>6}s x{r['processes']}: {r['per_second']:8.1f}/s  p50 {r['p50_ms']} ms  "
+                      f"p95 {r['p95_ms']} ms  max {r['max_ms']} ms  errors {r['errors']}", file=sys.stderr)
+    if args.output:
+        json.dump({'writers': args.writers, 'readers': args.readers, 'requests': args.requests,
+                   'results': reports}, args.output, indent=2)
+
+if __name__ == '__main__':
+    main()
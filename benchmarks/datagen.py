@@ -0,0 +1,103 @@
+import random
+from datetime import datetime, timedelta, time
+from flask import current_app
+from waweza import db
+from waweza.passwords import hash_password
+from waweza.models import User, Goal, GoalType, StatusType, Habit, HabitLog, Mood, MoodType
+from waweza.rollups import rebuild_rollups
+
+# Named dataset sizes: users, goals and habits per user, and days of history
+SIZES = {
+    'small': {'users': 5, 'goals': 3, 'habits': 4, 'days': 90},
+    'medium': {'users': 20, 'goals': 5, 'habits': 6, 'days': 365},
+    'large': {'users': 50, 'goals': 5, 'habits': 8, 'days': 3 * 365}
+}
+INSERT_CHUNK_SIZE = 10000
+# Mood types are not equally likely; most days are unremarkable
+MOOD_WEIGHTS = {
+    MoodType.HAPPY: 3, MoodType.FRUSTRATED: 1, MoodType.NEUTRAL: 5,
+    MoodType.SAD: 1, MoodType.ANXIOUS: 1
+}
+
+
+def _insert(table, rows):
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.session.execute(table.insert(), rows[i:i + INSERT_CHUNK_SIZE])
+
+def generate(users=5, goals=3, habits=4, days=90, seed=0, today=None):
+    # Fill the current database with synthetic users and their history, ending today.
+    # Runs inside an app context; returns the ids of the generated users.
+    rng = random.Random(seed)
+    today = today or datetime.utcnow().date()
+    first_day = today - timedelta(days=days - 1)
+    password = hash_password('benchmark', current_app.config['BCRYPT_LOG_ROUNDS'])
+    mood_types = list(MOOD_WEIGHTS)
+    mood_weights = list(MOOD_WEIGHTS.values())
+
+    user_ids = []
+    for n in range(users):
+        user = User(username=f'bench{n}', email=f'bench{n}@example.com', password=password, verified=True)
+        db.session.add(user)
+        db.session.flush()
+        user_ids.append(user.id)
+
+        goal_rows = []
+        for g in range(goals):
+            start = first_day + timedelta(days=rng.randrange(days))
+            goal_rows.append(Goal(
+                user_id=user.id,
+                title=f'Goal {g}',
+                description='Synthetic benchmark goal',
+                type=rng.choice(list(GoalType)),
+                status=rng.choice(list(StatusType)),
+                start_date=datetime.combine(start, time()),
+                end_date=datetime.combine(start + timedelta(days=rng.randint(7, 365)), time())
+            ))
+        db.session.add_all(goal_rows)
+        db.session.flush()
+
+        habit_rows = [Habit(user_id=user.id, goal_id=rng.choice(goal_rows).id, name=f'Habit {h}')
+                      for h in range(habits)]
+        db.session.add_all(habit_rows)
+        db.session.flush()
+
+        # Each habit has its own consistency; some days it is not logged at all
+        logs, moods = [], []
+        for habit in habit_rows:
+            consistency = rng.uniform(0.3, 0.95)
+            for offset in range(days):
+                if rng.random() < 0.15:
+                    continue
+                day = first_day + timedelta(days=offset)
+                logs.append({
+                    'habit_id': habit.id,
+                    'date': datetime.combine(day, time()),
+                    'day': day,
+                    'completed': rng.random() < consistency,
+                    'notes': None
+                })
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            for _ in range(rng.choice((0, 1, 1, 1, 2, 3))):
+                moods.append({
+                    'user_id': user.id,
+                    'date': datetime.combine(day, time(rng.randrange(7, 23), rng.randrange(60))),
+                    'day': day,
+                    'mood_type': rng.choices(mood_types, mood_weights)[0],
+                    'notes': None
+                })
+        _insert(HabitLog.__table__, logs)
+        _insert(Mood.__table__, moods)
+        db.session.commit()
+
+    rebuild_rollups()
+    return user_ids
+
+def row_counts():
+    return {
+        'users': User.query.count(),
+        'goals': Goal.query.count(),
+        'habits': Habit.query.count(),
+        'habit_logs': HabitLog.query.count(),
+        'moods': Mood.query.count()
+    }
@@ -0,0 +1,143 @@
+"""Sustained mood and habit-log write throughput, written directly or through the ingest buffer.
+
+    python -m benchmarks.ingest_storm --users 8 --seconds 10
+
+Each thread is a different user posting a mood or a habit status update as fast as it
+can, all in one process like a threaded web worker. 'direct' commits every write in its
+request; 'buffered' stages it and lets the flusher group-commit. After the run every
+staged write is applied and the row counts are checked against the accepted posts.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+PROFILES = {
+    'direct': {'INGEST_BUFFER': False},
+    'buffered': {'INGEST_BUFFER': True}
+}
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 3)
+
+def _loop(app, user_id, habit_id, stop, results):
+    timings, statuses, moods = [], {}, 0
+    day = datetime.utcnow().date()
+    # The same logged-in cookie on every request: a cookie jar would collect a flash
+    # message per post and the session would grow without bound
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'_user_id': str(user_id), '_fresh': True})
+    headers = {'Cookie': f"{app.config['SESSION_COOKIE_NAME']}={cookie}"}
+    with app.test_client(use_cookies=False) as client:
+        n = 0
+        while not stop.is_set():
+            t = time.perf_counter()
+            if n % 2:
+                # One mood per day going back, so moods never pile up on one day
+                response = client.post('/moods', data={'date': (day - timedelta(days=n // 2)).isoformat(),
+                                                       'mood_type': 'HAPPY', 'notes': ''}, headers=headers)
+                moods += response.status_code == 302
+            else:
+                response = client.post(f'/habit/{habit_id}/update',
+                                       data={'status': 'completed' if n % 4 else 'not_completed'}, headers=headers)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 302:
+                timings.append((time.perf_counter() - t) * 1000)
+            n += 1
+    results.append((timings, statuses, moods))
+
+def run_profile(profile, users, seconds):
+    from waweza import create_app, db
+    from waweza.models import User, Goal, Habit, Mood, GoalType, StatusType
+    from waweza.ingest import get_buffer
+
+    fd, path = tempfile.mkstemp(prefix=f'waweza-ingest-{profile}-', suffix='.db')
+    os.close(fd)
+    app = create_app(dict(PROFILES[profile], SQLALCHEMY_DATABASE_URI='sqlite:///' + path, SECRET_KEY='benchmark',
+                          WTF_CSRF_ENABLED=False, SQLALCHEMY_RECORD_QUERIES=False,
+                          INGEST_PATH=path + '.ingest'))
+    with app.app_context():
+        db.create_all()
+        habits = []
+        for n in range(users):
+            user = User(username=f'writer{n}', email=f'writer{n}@example.com', password='x', verified=True)
+            db.session.add(user)
+            db.session.flush()
+            goal = Goal(user_id=user.id, title='Write', description='Write a lot', type=GoalType.SHORT_TERM,
+                        end_date=datetime.utcnow(), status=StatusType.STARTED)
+            db.session.add(goal)
+            db.session.flush()
+            habit = Habit(user_id=user.id, goal_id=goal.id, name='Log')
+            db.session.add(habit)
+            db.session.flush()
+            habits.append((user.id, habit.id))
+        db.session.commit()
+
+    stop = threading.Event()
+    results = []
+    threads = [threading.Thread(target=_loop, args=(app, user_id, habit_id, stop, results))
+               for user_id, habit_id in habits]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    t = time.perf_counter()
+    with app.app_context():
+        if get_buffer() is not None:
+            get_buffer().flush()
+        drain_ms = (time.perf_counter() - t) * 1000
+        stored = Mood.query.count()
+        db.engine.dispose()
+    for suffix in ('', '.ingest', '.ingest-wal', '.ingest-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    timings = [t for outcome, _, _ in results for t in outcome]
+    statuses = {}
+    for _, outcome, _ in results:
+        for status, n in outcome.items():
+            statuses[status] = statuses.get(status, 0) + n
+    accepted = sum(moods for _, _, moods in results)
+    return {
+        'profile': profile,
+        'writes_per_second': round(len(timings) / seconds, 1),
+        'p50_ms': _percentile(timings, 50),
+        'p95_ms': _percentile(timings, 95),
+        'statuses': statuses,
+        'drain_ms': round(drain_ms, 1),
+        'moods_accepted': accepted,
+        'moods_stored': stored
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure mood and habit-log write throughput.')
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--profiles', default=','.join(PROFILES))
+    parser.add_argument('--output', type=argparse.FileType('w'), default=None)
+    args = parser.parse_args(argv)
+
+    reports = []
+    for profile in args.profiles.split(','):
+        if profile not in PROFILES:
+            parser.error(f'unknown profile {profile}')
+        r = run_profile(profile, args.users, args.seconds)
+        reports.append(r)
+        print(f"{profile:>8}: {r['writes_per_second']:8.1f} writes/s  p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms  "
+              f"statuses {r['statuses']}  drain {r['drain_ms']} ms  moods {r['moods_stored']}/{r['moods_accepted']}",
+              file=sys.stderr)
+    if args.output:
+        json.dump({'users': args.users, 'seconds': args.seconds, 'results': reports}, args.output, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Throughput of a cheap page while /login is flooded, per password hashing profile.
+
+    python -m benchmarks.login_storm --stormers 8 --readers 2 --seconds 10
+
+Storm threads post valid logins as fast as they can while reader threads fetch
+/about, all in one process like a threaded web worker. 'inline' hashes on the
+request threads with no cap; 'pool' uses the bounded process pool, so logins
+over the cap wait for a slot or get a 503 instead of competing for the CPU.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+PROFILES = {
+    'inline': {'PASSWORD_HASH_WORKERS': 0, 'PASSWORD_HASH_CONCURRENCY': 1000},
+    'pool': {'PASSWORD_HASH_TIMEOUT': 1.0}
+}
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 3)
+
+def _loop(app, send, stop, results):
+    timings, statuses = [], {}
+    # Without cookies every login really checks the password
+    with app.test_client(use_cookies=False) as client:
+        while not stop.is_set():
+            t = time.perf_counter()
+            status = send(client).status_code
+            statuses[status] = statuses.get(status, 0) + 1
+            if status in (200, 302):
+                timings.append((time.perf_counter() - t) * 1000)
+    results.append((timings, statuses))
+
+def _summary(results, seconds):
+    timings = [t for outcome, _ in results for t in outcome]
+    statuses = {}
+    for _, outcome in results:
+        for status, n in outcome.items():
+            statuses[status] = statuses.get(status, 0) + n
+    return {
+        'ok_per_second': round(len(timings) / seconds, 1),
+        'p50_ms': _percentile(timings, 50),
+        'p95_ms': _percentile(timings, 95),
+        'statuses': statuses
+    }
+
+def run_profile(profile, stormers, readers, seconds, rounds):
+    from waweza import create_app, db, password_hasher
+    from waweza.models import User
+
+    fd, path = tempfile.mkstemp(prefix=f'waweza-login-{profile}-', suffix='.db')
+    os.close(fd)
+    app = create_app(dict(PROFILES[profile], SQLALCHEMY_DATABASE_URI='sqlite:///' + path, SECRET_KEY='benchmark',
+                          WTF_CSRF_ENABLED=False, SQLALCHEMY_RECORD_QUERIES=False, BCRYPT_LOG_ROUNDS=rounds))
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username='storm', email='storm@example.com', verified=True,
+                            password=password_hasher.generate_password_hash('benchmark')))
+        db.session.commit()
+
+    login = lambda client: client.post('/login', data={'email': 'storm@example.com', 'password': 'benchmark'})
+    about = lambda client: client.get('/about')
+    stop = threading.Event()
+    storm_results, reader_results = [], []
+    threads = [threading.Thread(target=_loop, args=(app, login, stop, storm_results)) for _ in range(stormers)]
+    threads += [threading.Thread(target=_loop, args=(app, about, stop, reader_results)) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        db.engine.dispose()
+    os.remove(path)
+    return {'profile': profile, 'login': _summary(storm_results, seconds), 'about': _summary(reader_results, seconds)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure cheap page throughput during a login storm.')
+    parser.add_argument('--stormers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost factor.')
+    parser.add_argument('--profiles', default=','.join(PROFILES))
+    parser.add_argument('--output', type=argparse.FileType('w'), default=None)
+    args = parser.parse_args(argv)
+
+    reports = []
+    for profile in args.profiles.split(','):
+        if profile not in PROFILES:
+            parser.error(f'unknown profile {profile}')
+        report = run_profile(profile, args.stormers, args.readers, args.seconds, args.rounds)
+        reports.append(report)
+        for name in ('login', 'about'):
+            r = report[name]
+            print(f"{profile:>6} {name:>5}: {r['ok_per_second']:8.1f}/s  p50 {r['p50_ms']} ms  "
+                  f"p95 {r['p95_ms']} ms  statuses {r['statuses']}", file=sys.stderr)
+    if args.output:
+        json.dump({'stormers': args.stormers, 'readers': args.readers, 'seconds': args.seconds,
+                   'rounds': args.rounds, 'results': reports}, args.output, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Latency, SQL and memory benchmarks for the main pages.
+
+    python -m benchmarks.run --sizes small,medium --iterations 30
+    python -m benchmarks.run --baseline benchmarks/results/<earlier run>.json
+    python -m benchmarks.run --accept-encoding 'br, gzip'
+
+Every size gets its own temporary SQLite database filled by benchmarks.datagen. Each
+endpoint is requested through the Flask test client, both with the response cache
+cleared before every request (cold) and with it left alone (warm). Bytes are what
+goes on the wire, so they depend on --accept-encoding. The results are written as
+JSON; with --baseline the p50s are compared against an earlier run.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from waweza import create_app, db
+from benchmarks.datagen import SIZES, generate, row_counts
+
+ENDPOINTS = ['/home', '/analytics', '/habits', '/moods', '/analytics/data?window=quarter']
+MODES = ('cold', 'warm')
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = (len(values) - 1) * pct / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(client, url, mode, iterations, statements, headers):
+    # Returns the timings of `iterations` requests plus the SQL count and peak memory of one more
+    def request():
+        if mode == 'cold':
+            client.application.extensions['waweza_cache'].clear()
+        response = client.get(url, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+        return response
+
+    request()  # warm-up: templates compiled, cache filled for the warm mode
+    timings, cpu = [], []
+    for _ in range(iterations):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        request()
+        timings.append((time.perf_counter() - start) * 1000)
+        cpu.append((time.process_time() - start_cpu) * 1000)
+
+    statements.clear()
+    tracemalloc.start()
+    response = request()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'cpu_ms': round(sum(cpu) / len(cpu), 3),
+        'queries': len(statements),
+        'peak_kb': round(peak / 1024, 1),
+        'bytes': len(response.get_data())
+    }
+
+def run_size(size, iterations, seed, headers):
+    fd, path = tempfile.mkstemp(prefix=f'waweza-bench-{size}-', suffix='.db')
+    os.close(fd)
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'SQLALCHEMY_RECORD_QUERIES': False,
+        'WTF_CSRF_ENABLED': False,
+        'SECRET_KEY': os.environ.get('SECRET_KEY') or 'benchmark'
+    })
+    try:
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            user_ids = generate(seed=seed, **SIZES[size])
+            generate_seconds = time.perf_counter() - started
+            counts = row_counts()
+
+        # Listening on the class counts the reader pool's statements as well as the writer's
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(Engine, 'before_cursor_execute', listener)
+        results = []
+        try:
+            with app.test_client() as client:
+                with client.session_transaction() as session:
+                    session['_user_id'] = str(user_ids[0])
+                    session['_fresh'] = True
+                for url in ENDPOINTS:
+                    for mode in MODES:
+                        result = {'size': size, 'endpoint': url, 'mode': mode}
+                        result.update(measure(client, url, mode, iterations, statements, headers))
+                        results.append(result)
+                        print(f"{size:>7} {mode:>4} {url:<32} p50 {result['p50_ms']:8.2f} ms  "
+                              f"p95 {result['p95_ms']:8.2f} ms  {result['queries']:3} queries  "
+                              f"{result['peak_kb']:9.1f} KiB  {result['bytes']:8} B  cpu {result['cpu_ms']:7.2f} ms",
+                              file=sys.stderr)
+        finally:
+            event.remove(Engine, 'before_cursor_execute', listener)
+        return {'size': size, 'rows': counts, 'generate_seconds': round(generate_seconds, 2)}, results
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+            reader = app.extensions['waweza_storage'].get_reader(app)
+            if reader is not None:
+                reader.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+def compare(baseline, current):
+    # Print the p50 of every endpoint next to the baseline's, flagging anything 20% slower
+    previous = {(r['size'], r['endpoint'], r['mode']): r for r in baseline['results']}
+    for result in current['results']:
+        before = previous.get((result['size'], result['endpoint'], result['mode']))
+        if before is None:
+            continue
+        ratio = result['p50_ms'] / before['p50_ms'] if before['p50_ms'] else 1
+        flag = '  REGRESSION' if ratio > 1.2 else ''
+        print(f"{result['size']:>7} {result['mode']:>4} {result['endpoint']:<32} "
+              f"{before['p50_ms']:8.2f} -> {result['p50_ms']:8.2f} ms ({ratio:.2f}x), "
+              f"queries {before['queries']} -> {result['queries']}, "
+              f"bytes {before['bytes']} -> {result['bytes']}{flag}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the main pages against synthetic data.')
+    parser.add_argument('--sizes', default='small', help=f"Comma separated, from {', '.join(SIZES)}.")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Where to write the JSON results; defaults to benchmarks/results/.')
+    parser.add_argument('--baseline', help='Earlier results to compare against.')
+    parser.add_argument('--accept-encoding', default='', help="Sent with every request, e.g. 'br, gzip'.")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes.split(',')
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown size(s): {', '.join(unknown)}")
+
+    commit = git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'created_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'seed': args.seed,
+            'accept_encoding': args.accept_encoding
+        },
+        'datasets': [],
+        'results': []
+    }
+    headers = {'Accept-Encoding': args.accept_encoding} if args.accept_encoding else {}
+    for size in sizes:
+        dataset, results = run_size(size, args.iterations, args.seed, headers)
+        report['datasets'].append(dataset)
+        report['results'].extend(results)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S}-{commit or 'unknown'}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}', file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
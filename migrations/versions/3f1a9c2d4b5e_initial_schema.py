@@ -0,0 +1,112 @@
+"""initial schema
+
+Revision ID: 3f1a9c2d4b5e
+Revises: 
+Create Date: 2026-10-18 09:12:40.118532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a9c2d4b5e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created with db.create_all() already have these tables, so only
+    # create the ones that are missing and let them upgrade in place
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'user' not in existing:
+        op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=20), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('image_file', sa.String(length=20), nullable=False),
+        sa.Column('password', sa.String(length=60), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('verified', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username')
+        )
+    if 'goal' not in existing:
+        op.create_table('goal',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=100), nullable=False),
+        sa.Column('description', sa.String(length=200), nullable=False),
+        sa.Column('type', sa.Enum('SHORT_TERM', 'LONG_TERM', name='goaltype'), nullable=False),
+        sa.Column('start_date', sa.DateTime(), nullable=False),
+        sa.Column('end_date', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('status', sa.Enum('NOTSTARTED', 'STARTED', 'COMPLETED', name='statustype'), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'mood' not in existing:
+        op.create_table('mood',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('mood_type', sa.Enum('HAPPY', 'FRUSTRATED', 'NEUTRAL', 'SAD', 'ANXIOUS', name='moodtype'), nullable=False),
+        sa.Column('notes', sa.Text(), nullable=True),
+        sa.Column('date', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'habit' not in existing:
+        op.create_table('habit',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('goal_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=20), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['goal_id'], ['goal.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'habit_log' not in existing:
+        op.create_table('habit_log',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('habit_id', sa.Integer(), nullable=False),
+        sa.Column('date', sa.DateTime(), nullable=False),
+        sa.Column('completed', sa.Boolean(), nullable=False),
+        sa.Column('notes', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['habit_id'], ['habit.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'habit_daily_rollup' not in existing:
+        op.create_table('habit_daily_rollup',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('completed', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'day')
+        )
+    if 'mood_daily_rollup' not in existing:
+        op.create_table('mood_daily_rollup',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('mood_type', sa.Enum('HAPPY', 'FRUSTRATED', 'NEUTRAL', 'SAD', 'ANXIOUS', name='moodtype'), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'day', 'mood_type')
+        )
+
+
+def downgrade():
+    op.drop_table('mood_daily_rollup')
+    op.drop_table('habit_daily_rollup')
+    op.drop_table('habit_log')
+    op.drop_table('habit')
+    op.drop_table('mood')
+    op.drop_table('goal')
+    op.drop_table('user')
@@ -0,0 +1,67 @@
+"""add day columns and indexes
+
+Revision ID: 8b7e2d61c0a9
+Revises: 3f1a9c2d4b5e
+Create Date: 2026-10-18 10:03:27.640915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b7e2d61c0a9'
+down_revision = '3f1a9c2d4b5e'
+branch_labels = None
+depends_on = None
+
+
+def _day_of(column):
+    # SQLite has no DATE type, the app stores dates as 'YYYY-MM-DD' text
+    if op.get_bind().dialect.name == 'sqlite':
+        return sa.func.date(column)
+    return sa.cast(column, sa.Date)
+
+
+def upgrade():
+    with op.batch_alter_table('habit_log', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('day', sa.Date(), nullable=True))
+
+    with op.batch_alter_table('mood', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('day', sa.Date(), nullable=True))
+
+    # Backfill the new columns from the existing timestamps
+    habit_log = sa.table('habit_log', sa.column('date', sa.DateTime), sa.column('day', sa.Date))
+    mood = sa.table('mood', sa.column('date', sa.DateTime), sa.column('day', sa.Date))
+    op.execute(habit_log.update().values(day=_day_of(habit_log.c.date)))
+    op.execute(mood.update().values(day=_day_of(mood.c.date)))
+
+    with op.batch_alter_table('habit_log', schema=None) as batch_op:
+        batch_op.alter_column('day', existing_type=sa.Date(), nullable=False)
+        batch_op.create_index('ix_habit_log_habit_id_day', ['habit_id', 'day'], unique=False)
+
+    with op.batch_alter_table('mood', schema=None) as batch_op:
+        batch_op.alter_column('day', existing_type=sa.Date(), nullable=False)
+        batch_op.create_index('ix_mood_user_id_day', ['user_id', 'day'], unique=False)
+
+    with op.batch_alter_table('goal', schema=None) as batch_op:
+        batch_op.create_index('ix_goal_user_id_status', ['user_id', 'status'], unique=False)
+
+    with op.batch_alter_table('habit', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_habit_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('habit', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_habit_user_id'))
+
+    with op.batch_alter_table('goal', schema=None) as batch_op:
+        batch_op.drop_index('ix_goal_user_id_status')
+
+    with op.batch_alter_table('mood', schema=None) as batch_op:
+        batch_op.drop_index('ix_mood_user_id_day')
+        batch_op.drop_column('day')
+
+    with op.batch_alter_table('habit_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_habit_log_habit_id_day')
+        batch_op.drop_column('day')
@@ -0,0 +1,40 @@
+"""unique habit log per day
+
+Revision ID: c52d0e7a9f13
+Revises: 8b7e2d61c0a9
+Create Date: 2026-10-18 11:26:51.302774
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52d0e7a9f13'
+down_revision = '8b7e2d61c0a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep only the newest log of each habit and day, which is the one the UI showed
+    op.execute('DELETE FROM habit_log WHERE id NOT IN '
+               '(SELECT MAX(id) FROM habit_log GROUP BY habit_id, day)')
+
+    with op.batch_alter_table('habit_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_habit_log_habit_id_day')
+        batch_op.create_unique_constraint('uq_habit_log_habit_id_day', ['habit_id', 'day'])
+
+    # The removed duplicates were counted in the rollups, so rebuild them
+    op.execute('DELETE FROM habit_daily_rollup')
+    op.execute('INSERT INTO habit_daily_rollup (user_id, day, completed, total) '
+               'SELECT habit.user_id, habit_log.day, '
+               'SUM(CASE WHEN habit_log.completed THEN 1 ELSE 0 END), COUNT(habit_log.id) '
+               'FROM habit_log JOIN habit ON habit.id = habit_log.habit_id '
+               'GROUP BY habit.user_id, habit_log.day')
+
+
+def downgrade():
+    with op.batch_alter_table('habit_log', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_habit_log_habit_id_day', type_='unique')
+        batch_op.create_index('ix_habit_log_habit_id_day', ['habit_id', 'day'], unique=False)
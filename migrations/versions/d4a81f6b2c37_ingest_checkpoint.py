@@ -0,0 +1,28 @@
+"""ingest checkpoint
+
+Revision ID: d4a81f6b2c37
+Revises: c52d0e7a9f13
+Create Date: 2026-10-18 14:12:05.418236
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a81f6b2c37'
+down_revision = 'c52d0e7a9f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ingest_checkpoint',
+    sa.Column('source', sa.String(length=32), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade():
+    op.drop_table('ingest_checkpoint')
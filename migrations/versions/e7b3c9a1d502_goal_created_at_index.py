@@ -0,0 +1,27 @@
+"""goal created_at index
+
+Revision ID: e7b3c9a1d502
+Revises: d4a81f6b2c37
+Create Date: 2026-10-18 16:40:12.553019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3c9a1d502'
+down_revision = 'd4a81f6b2c37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The goals list pages through a user's goals newest first
+    with op.batch_alter_table('goal', schema=None) as batch_op:
+        batch_op.create_index('ix_goal_user_id_created_at', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('goal', schema=None) as batch_op:
+        batch_op.drop_index('ix_goal_user_id_created_at')
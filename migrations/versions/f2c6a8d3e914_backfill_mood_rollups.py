@@ -0,0 +1,28 @@
+"""backfill mood rollups
+
+Revision ID: f2c6a8d3e914
+Revises: e7b3c9a1d502
+Create Date: 2026-10-18 19:02:37.418260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6a8d3e914'
+down_revision = 'e7b3c9a1d502'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The rollup table was created empty on databases that already had moods
+    op.execute('DELETE FROM mood_daily_rollup')
+    op.execute('INSERT INTO mood_daily_rollup (user_id, day, mood_type, count) '
+               'SELECT user_id, day, mood_type, COUNT(id) FROM mood '
+               'GROUP BY user_id, day, mood_type')
+
+
+def downgrade():
+    pass
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+import pytest
+from waweza import create_app, db
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    # An app on its own SQLite file and instance files, so tests never share state
+    apps = []
+
+    def make(**config):
+        settings = {
+            'TESTING': True,
+            'SECRET_KEY': 'test',
+            'WTF_CSRF_ENABLED': False,
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'waweza.db'}",
+            'INGEST_PATH': str(tmp_path / 'ingest.db'),
+            'CACHE_PATH': str(tmp_path / 'cache.db'),
+            'TEMPLATE_BYTECODE_CACHE_DIR': None,
+            'MAIL_DEAD_LETTER_PATH': str(tmp_path / 'mail_dead_letter.jsonl')
+        }
+        settings.update(config)
+        app = create_app(settings)
+        with app.app_context():
+            db.create_all()
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+@pytest.fixture
+def make_user(app):
+    # A verified user with one goal, one habit logged today and one mood; returns their ids
+    from waweza.models import User, Goal, GoalType, StatusType, Habit, HabitLog, Mood, MoodType
+
+    def make(name):
+        now = datetime.utcnow()
+        with app.app_context():
+            user = User(username=name, email=f'{name}@example.com', password='x', verified=True)
+            db.session.add(user)
+            db.session.flush()
+            goal = Goal(user_id=user.id, title=f'{name} goal', description='A goal', type=GoalType.SHORT_TERM,
+                        end_date=now + timedelta(days=30), status=StatusType.STARTED)
+            db.session.add(goal)
+            db.session.flush()
+            habit = Habit(user_id=user.id, goal_id=goal.id, name=f'{name} habit')
+            db.session.add(habit)
+            db.session.flush()
+            log = HabitLog(habit_id=habit.id, date=now, completed=True, notes=f'{name} log')
+            mood = Mood(user_id=user.id, date=now, mood_type=MoodType.HAPPY, notes=f'{name} mood')
+            db.session.add_all([log, mood])
+            db.session.commit()
+            return {'user': user.id, 'goal': goal.id, 'habit': habit.id, 'habit_log': log.id, 'mood': mood.id}
+
+    return make
+
+@pytest.fixture
+def login(app):
+    def login(client, user_id):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+
+    return login
@@ -0,0 +1,20 @@
+from datetime import date, datetime
+import pytest
+from waweza import helpers
+
+
+class LateSunday(datetime):
+    # 23:30 UTC on Sunday 2024-03-31 is already Monday 2024-04-01 in UTC+1
+    @classmethod
+    def utcnow(cls):
+        return cls(2024, 3, 31, 23, 30)
+
+
+@pytest.mark.parametrize('window, expected', [
+    ('week', (date(2024, 3, 25), date(2024, 3, 31))),
+    ('month', (date(2024, 3, 1), date(2024, 3, 31))),
+    ('quarter', (date(2024, 1, 1), date(2024, 3, 31)))
+])
+def test_windows_follow_the_utc_day_of_the_data(monkeypatch, window, expected):
+    monkeypatch.setattr(helpers, 'datetime', LateSunday)
+    assert helpers.get_window_range(window) == expected
@@ -0,0 +1,18 @@
+from PIL import Image
+from waweza import assets
+
+
+def test_build_skips_image_formats_pillow_cannot_write(app, tmp_path, monkeypatch):
+    Image.init()
+    monkeypatch.delitem(Image.SAVE, 'AVIF', raising=False)
+    Image.new('RGB', (64, 32), 'red').save(tmp_path / 'banner.png')
+    (tmp_path / 'site.css').write_text('.hero {\n  background-image: url("banner.png");\n}\n')
+
+    manifest = assets.build_assets(str(tmp_path), widths=(32,), min_size=0)
+    assert set(manifest['images']['banner.png']) == {'webp'}
+    css = (tmp_path / manifest['files']['site.css']).read_text()
+    assert 'image/webp' in css and 'image/avif' not in css
+
+    with app.test_request_context():
+        app.extensions['waweza_assets'] = manifest
+        assert [source['type'] for source in assets.image_sources('banner.png')] == ['image/webp']
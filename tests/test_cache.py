@@ -0,0 +1,21 @@
+from datetime import datetime
+
+
+def test_page_cache_is_shared_between_workers(make_app, make_user, login):
+    # Two apps on one database and cache file stand in for two gunicorn workers
+    first, second = make_app(), make_app()
+    assert first.config['CACHE_BACKEND'] == 'sqlite'
+    ids = make_user('worker')
+    clients = [login(app.test_client(), ids['user']) for app in (first, second)]
+    before = clients[1].get('/home/summary.json').get_json()
+
+    # A write through the first worker, applied by the ingest buffer
+    today = datetime.utcnow().date().isoformat()
+    clients[0].post('/moods', data={'date': today, 'mood_type': 'SAD', 'notes': 'shared'})
+    after = clients[1].get('/home/summary.json').get_json()
+    assert after != before
+    assert clients[1].get('/home/summary.json').get_json() == after
+
+
+def test_in_memory_database_keeps_a_private_cache(make_app):
+    assert make_app(SQLALCHEMY_DATABASE_URI='sqlite://').config['CACHE_BACKEND'] == 'memory'
@@ -0,0 +1,29 @@
+from datetime import date, timedelta
+import pytest
+from waweza import db, helpers
+from waweza.helpers import habit_log_row, upsert_habit_logs
+from waweza.models import HabitLog
+
+
+@pytest.mark.parametrize('on_conflict', [True, False])
+def test_upsert_merges_on_habit_and_day(app, make_user, monkeypatch, on_conflict):
+    if not on_conflict:
+        # The select-then-write path other databases take
+        monkeypatch.setattr(helpers, 'UPSERT_DIALECTS', ())
+    habit_id = make_user('logger')['habit']
+    today = date.today()
+    with app.app_context():
+        upsert_habit_logs([habit_log_row(habit_id, today, False, 'tired'),
+                           habit_log_row(habit_id, today - timedelta(days=1), True)])
+        upsert_habit_logs([habit_log_row(habit_id, today, True)])
+        db.session.commit()
+        logs = {log.day: (log.completed, log.notes) for log in HabitLog.query.filter_by(habit_id=habit_id)}
+    assert logs == {today: (True, 'tired'), today - timedelta(days=1): (True, None)}
+
+@pytest.mark.parametrize('body', [[1, 2], 'x', 5])
+def test_batch_log_rejects_a_json_body_that_is_not_an_object(app, make_user, login, body):
+    app.config['WTF_CSRF_ENABLED'] = True
+    client = login(app.test_client(), make_user('logger')['user'])
+    response = client.post('/habits/log', json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Expected a JSON object.'}
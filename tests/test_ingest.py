@@ -0,0 +1,86 @@
+import time
+from datetime import datetime
+import pytest
+from waweza.ingest import get_buffer
+from waweza.models import HabitLog, Mood
+
+
+def _log_today(client, habit_id):
+    today = datetime.utcnow().date().isoformat()
+    return client.post(f'/habit/{habit_id}/log', data={'date': today, 'completed': 'y', 'notes': 'direct'})
+
+def _log_batch(client, habit_id):
+    return client.post('/habits/log', json={'habit_ids': [habit_id], 'completed': True, 'notes': 'direct'})
+
+@pytest.mark.parametrize('direct_write', [_log_today, _log_batch])
+def test_direct_habit_log_lands_after_staged_ones(make_app, make_user, login, direct_write):
+    # The flusher stays idle, so only the direct write itself can apply the staged one
+    app = make_app(INGEST_MAX_LATENCY=60)
+    ids = make_user('writer')
+    client = login(app.test_client(), ids['user'])
+
+    client.post(f"/habit/{ids['habit']}/update", data={'status': 'not_completed', 'notes': 'staged'})
+    with app.app_context():
+        assert get_buffer().pending(ids['user'])
+    assert direct_write(client, ids['habit']).status_code in (200, 302)
+
+    with app.app_context():
+        assert not get_buffer().pending(ids['user'])
+        get_buffer().flush()
+        log = HabitLog.query.filter_by(habit_id=ids['habit'], day=datetime.utcnow().date()).one()
+        assert (log.completed, log.notes) == (True, 'direct')
+
+def test_failing_write_is_quarantined_without_blocking_reads(make_app, make_user, login, caplog):
+    app = make_app(INGEST_MAX_LATENCY=60, INGEST_MAX_ATTEMPTS=3)
+    ids = make_user('writer')
+    client = login(app.test_client(), ids['user'])
+    today = datetime.utcnow().date().isoformat()
+    with app.app_context():
+        buffer = get_buffer()
+        buffer.append(ids['user'], 'mood', {'day': today, 'mood_type': 'NO_SUCH_MOOD'})
+        buffer.append(ids['user'], 'mood', {'day': today, 'mood_type': 'SAD', 'notes': 'after'})
+
+    # Every page view tries once more and still loads
+    for _ in range(3):
+        assert client.get('/goals').status_code == 200
+
+    with app.app_context():
+        assert not buffer.pending()
+        assert [(kind, attempts) for _, _, kind, _, attempts, _ in buffer.quarantined()] == [('mood', 3)]
+        assert Mood.query.filter_by(user_id=ids['user'], notes='after').count() == 1
+    assert 'Quarantined staged mood write' in caplog.text
+
+def _stage_moods(buffer, user_id, count):
+    for n in range(count):
+        buffer.append(user_id, 'mood', {'day': f'2024-01-{n + 1:02d}', 'mood_type': 'SAD'})
+
+def test_sync_applies_only_the_users_writes(make_app, make_user):
+    app = make_app(INGEST_MAX_LATENCY=60)
+    first, second = make_user('first')['user'], make_user('second')['user']
+    with app.app_context():
+        buffer = get_buffer()
+        # Staged first, so their ids are lower than those applied ahead of them
+        _stage_moods(buffer, second, 2)
+        _stage_moods(buffer, first, 3)
+        assert buffer.sync(first)
+        assert not buffer.pending(first) and buffer.pending(second)
+        assert Mood.query.filter_by(user_id=second).count() == 1
+
+        assert buffer.flush() == 2
+        assert Mood.query.filter_by(user_id=first).count() == 4
+        assert Mood.query.filter_by(user_id=second).count() == 3
+
+def test_flush_stops_at_the_deadline_and_when_the_lease_is_lost(make_app, make_user, monkeypatch):
+    app = make_app(INGEST_MAX_LATENCY=60, INGEST_BATCH_SIZE=1)
+    user_id = make_user('writer')['user']
+    with app.app_context():
+        buffer = get_buffer()
+        # Without the flusher thread, which a full batch would wake
+        monkeypatch.setattr(buffer, 'start', lambda: None)
+        _stage_moods(buffer, user_id, 4)
+        assert buffer.flush(user_id, deadline=time.monotonic()) == 1
+
+        renewals = iter([True, True, False])
+        monkeypatch.setattr(buffer, '_acquire_lease', lambda: next(renewals))
+        assert buffer.flush() == 2
+        assert Mood.query.filter_by(user_id=user_id).count() == 4
@@ -0,0 +1,97 @@
+import json
+import socket
+import pytest
+from flask_mail import Message
+from waweza import mail_queue
+
+aiosmtpd = pytest.importorskip('aiosmtpd.controller')
+
+
+class Collector:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('bounce'):
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _message(n=0, name='user'):
+    return Message(f'Hello {n}', sender='noreply@example.com', recipients=[f'{name}{n}@example.com'], body='Hi')
+
+@pytest.fixture
+def smtp_server():
+    handler = Collector()
+    controller = aiosmtpd.Controller(handler, hostname='127.0.0.1', port=_free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+def _mail_config(port, **config):
+    return dict({'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': port, 'MAIL_USE_TLS': False, 'MAIL_USE_SSL': False,
+                 'MAIL_USERNAME': None, 'MAIL_PASSWORD': None, 'MAIL_SUPPRESS_SEND': False}, **config)
+
+
+def test_queued_messages_are_delivered(make_app, smtp_server):
+    controller, handler = smtp_server
+    make_app(**_mail_config(controller.port))
+    for n in range(5):
+        mail_queue.enqueue(_message(n))
+    mail_queue.join()
+
+    assert sorted(envelope.rcpt_tos[0] for envelope in handler.messages) == \
+        [f'user{n}@example.com' for n in range(5)]
+    assert b'Subject: Hello 0' in next(e.content for e in handler.messages if e.rcpt_tos == ['user0@example.com'])
+
+def test_shutdown_waits_for_queued_messages(make_app, smtp_server, tmp_path):
+    controller, handler = smtp_server
+    make_app(**_mail_config(controller.port))
+    for n in range(3):
+        mail_queue.enqueue(_message(n))
+    mail_queue.shutdown()
+
+    assert len(handler.messages) == 3
+    assert not (tmp_path / 'mail_dead_letter.jsonl').exists()
+
+def test_shutdown_dead_letters_undelivered_messages(make_app, tmp_path):
+    # Nothing listens on the port, so the workers keep retrying until shutdown gives up
+    make_app(**_mail_config(_free_port(), MAIL_QUEUE_WORKERS=1, MAIL_QUEUE_BATCH_SIZE=2, MAIL_QUEUE_BACKOFF=5.0))
+    for n in range(4):
+        mail_queue.enqueue(_message(n))
+    mail_queue.shutdown(timeout=0.5)
+
+    records = [json.loads(line) for line in (tmp_path / 'mail_dead_letter.jsonl').read_text().splitlines()]
+    assert sorted(r['recipients'][0] for r in records) == [f'user{n}@example.com' for n in range(4)]
+
+def test_shutdown_dead_letters_only_undelivered_messages_of_a_batch(make_app, smtp_server, tmp_path):
+    # The second message is refused, so the worker is backing off with one message delivered
+    controller, handler = smtp_server
+    make_app(**_mail_config(controller.port, MAIL_QUEUE_WORKERS=1, MAIL_QUEUE_BATCH_SIZE=3, MAIL_QUEUE_BACKOFF=5.0))
+    mail_queue.enqueue(_message(0))
+    mail_queue.enqueue(_message(1, name='bounce'))
+    mail_queue.enqueue(_message(2))
+    mail_queue.shutdown(timeout=0.5)
+
+    assert [envelope.rcpt_tos for envelope in handler.messages] == [['user0@example.com']]
+    records = [json.loads(line) for line in (tmp_path / 'mail_dead_letter.jsonl').read_text().splitlines()]
+    assert [r['recipients'] for r in records] == [['bounce1@example.com'], ['user2@example.com']]
+    assert all('before the message was sent' in r['error'] for r in records)
+
+def test_exit_handler_is_registered_once(make_app, monkeypatch):
+    registered = []
+    monkeypatch.setattr('waweza.mailqueue.atexit.register', registered.append)
+    monkeypatch.setattr(mail_queue, '_exit_registered', False)
+    make_app()
+    make_app()
+    assert registered == [mail_queue.shutdown]
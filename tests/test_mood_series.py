@@ -0,0 +1,23 @@
+from datetime import datetime, timedelta
+import pytest
+from waweza import db
+from waweza.helpers import get_mood_series
+from waweza.models import Mood, MoodType
+
+
+@pytest.mark.parametrize('points', ['-5', '0', '2', 'many'])
+def test_series_rejects_invalid_points(app, make_user, login, points):
+    client = login(app.test_client(), make_user('charter')['user'])
+    response = client.get(f'/moods/series.json?bucket=raw&points={points}')
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('points, expected', [(-4, 3), (1, 3), (5, 5), (500, 10)])
+def test_raw_series_points_are_clamped(app, make_user, points, expected):
+    user_id = make_user('charter')['user']
+    today = datetime.utcnow()
+    with app.app_context():
+        db.session.add_all([Mood(user_id=user_id, date=today - timedelta(days=n), mood_type=MoodType.SAD)
+                            for n in range(1, 10)])
+        db.session.commit()
+        series = get_mood_series(user_id, today.date() - timedelta(days=30), today.date(), 'raw', points, max_points=366)
+    assert len(series['points']) == expected
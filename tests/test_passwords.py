@@ -0,0 +1,25 @@
+from concurrent.futures.process import BrokenProcessPool
+from waweza import password_hasher
+from waweza.models import User
+
+
+class BrokenPool:
+    # A pool whose workers die before they take any work
+    def submit(self, fn, *args):
+        raise BrokenProcessPool('A child process terminated abruptly')
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_register_hashes_inline_when_the_pool_keeps_breaking(make_app, monkeypatch):
+    app = make_app(BCRYPT_LOG_ROUNDS=4)
+    monkeypatch.setattr(password_hasher, '_get_pool', BrokenPool)
+    response = app.test_client().post('/register', data={
+        'username': 'newcomer', 'email': 'newcomer@example.com',
+        'password': 'secret', 'confirm_password': 'secret'
+    })
+    assert response.status_code == 302
+    with app.app_context():
+        user = User.query.filter_by(username='newcomer').one()
+        assert password_hasher.check_password_hash(user.password, 'secret')
@@ -0,0 +1,29 @@
+from io import BytesIO
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from waweza.utils import save_picture
+
+
+def _upload():
+    data = BytesIO()
+    Image.new('RGB', (200, 100), 'blue').save(data, 'PNG')
+    data.seek(0)
+    return FileStorage(data, filename='avatar.png')
+
+def test_each_app_processes_its_own_uploads(make_app, monkeypatch):
+    first, second = make_app(), make_app()
+    pools = [app.extensions['waweza_pictures'] for app in (first, second)]
+    assert pools[0] is not pools[1]
+    submitted = []
+    for pool in pools:
+        monkeypatch.setattr(pool, 'submit', lambda *args, pool=pool: submitted.append(pool))
+    with second.test_request_context():
+        save_picture(_upload())
+    assert submitted == [pools[1]]
+
+def test_oversized_upload_is_rejected(make_app):
+    app = make_app(PROFILE_PICTURE_MAX_BYTES=100)
+    with app.test_request_context():
+        with pytest.raises(ValueError, match='too large'):
+            save_picture(_upload())
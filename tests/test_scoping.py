@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+import pytest
+from flask_login import login_user
+from waweza import db
+from waweza.models import User, Goal, Habit, HabitLog, Mood, MoodType
+from waweza.rollups import rebuild_rollups
+from waweza.scoping import unscoped
+
+LISTING_ROUTES = ['/goals', '/habits', '/moods', '/habit/{habit}/history', '/export.ndjson',
+                  '/export/goals.csv', '/export/habits.csv', '/export/habit_logs.csv', '/export/moods.csv']
+AGGREGATE_ROUTES = ['/home/summary.json', '/analytics/data', '/analytics/data?window=quarter',
+                    '/moods/series.json?bucket=raw']
+
+
+@pytest.mark.parametrize('path', ['/goal/{goal}/edit', '/habit/{habit}/history', '/habit/{habit}/log',
+                                  '/moods/{mood}/edit'])
+def test_another_users_rows_are_not_found(app, make_user, login, path):
+    make_user('owner')
+    other = make_user('other')
+    client = login(app.test_client(), make_user('visitor')['user'])
+    assert client.get(path.format(**other)).status_code == 404
+
+def test_own_rows_are_found(app, make_user, login):
+    ids = make_user('owner')
+    client = login(app.test_client(), ids['user'])
+    for path in ('/goal/{goal}/edit', '/habit/{habit}/history', '/habit/{habit}/log'):
+        assert client.get(path.format(**ids)).status_code == 200
+
+def test_queries_are_scoped_until_unscoped(app, make_user):
+    owner, other = make_user('owner'), make_user('other')
+    with app.test_request_context():
+        login_user(db.session.get(User, owner['user']))
+        app.preprocess_request()
+        for model in (Goal, Habit, HabitLog, Mood):
+            assert model.query.count() == 1
+        assert db.session.get(Goal, other['goal']) is None
+
+        # Maintenance across users has to opt out
+        with unscoped():
+            assert Goal.query.count() == Habit.query.count() == HabitLog.query.count() == Mood.query.count() == 2
+            assert db.session.get(Goal, other['goal']) is not None
+        assert Goal.query.count() == 1
+
+@pytest.mark.parametrize('path', LISTING_ROUTES)
+def test_listings_hold_only_the_callers_rows(app, make_user, login, path):
+    make_user('zebra')
+    ids = make_user('visitor')
+    body = login(app.test_client(), ids['user']).get(path.format(**ids)).get_data(as_text=True)
+    assert 'visitor' in body
+    assert 'zebra' not in body
+
+def test_aggregates_ignore_other_users_rows(make_app, make_user, login):
+    # Nothing is cached, so every response is computed again from the tables
+    app = make_app(CACHE_TTL=0, TEMPLATE_FRAGMENT_CACHE=False)
+    ids = make_user('visitor')
+    client = login(app.test_client(), ids['user'])
+    with app.app_context():
+        rebuild_rollups(ids['user'])
+    before = {path: client.get(path).get_json() for path in AGGREGATE_ROUTES}
+
+    other = make_user('zebra')
+    with app.app_context():
+        db.session.add_all([Mood(user_id=other['user'], date=datetime.utcnow() - timedelta(days=n),
+                                 mood_type=MoodType.SAD) for n in range(1, 5)])
+        db.session.commit()
+        rebuild_rollups(other['user'])
+    assert {path: client.get(path).get_json() for path in AGGREGATE_ROUTES} == before
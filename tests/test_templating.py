@@ -0,0 +1,18 @@
+import pytest
+from waweza import db
+from waweza.models import Goal
+
+
+@pytest.mark.parametrize('backend, fragments', [('sqlite', True), ('memory', False)])
+def test_fragments_are_only_cached_in_the_shared_backend(make_app, make_user, login, backend, fragments):
+    app = make_app(CACHE_BACKEND=backend)
+    assert app.config['TEMPLATE_FRAGMENT_CACHE'] is fragments
+    ids = make_user('planner')
+    client = login(app.test_client(), ids['user'])
+    assert b'planner goal' in client.get('/goals').data
+
+    # Changed behind the app's back, so only an uncached fragment shows it
+    with app.app_context():
+        db.session.get(Goal, ids['goal']).title = 'renamed goal'
+        db.session.commit()
+    assert (b'renamed goal' in client.get('/goals').data) is not fragments
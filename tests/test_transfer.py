@@ -0,0 +1,32 @@
+import json
+from waweza import db
+from waweza.models import User, Mood
+from waweza.transfer import import_ndjson
+
+
+def test_import_rejects_malformed_records_line_by_line(make_app):
+    app = make_app()
+    lines = [
+        '[1, 2]',
+        '"x"',
+        json.dumps({'type': 'mood', 'date': '2024-01-02', 'mood_type': 'HAPPY', 'notes': {'a': 1}}),
+        json.dumps({'type': 'mood', 'date': 20240102, 'mood_type': 'HAPPY'}),
+        json.dumps({'type': 'habit', 'id': 1, 'goal_id': [1], 'name': 'Run'}),
+        json.dumps({'type': 'mood', 'date': '2024-01-03', 'mood_type': 'HAPPY', 'notes': 'fine'})
+    ]
+    with app.app_context():
+        user = User(username='importer', email='importer@example.com', password='x', verified=True)
+        db.session.add(user)
+        db.session.commit()
+        summary = import_ndjson(user.id, lines)
+
+        assert summary['imported'] == 1
+        assert summary['rejected'] == 5
+        assert summary['errors'] == [
+            'line 1: expected a JSON object',
+            'line 2: expected a JSON object',
+            'line 3: notes must be a string',
+            'line 4: date must be a string',
+            'line 5: unknown goal_id [1]'
+        ]
+        assert [mood.notes for mood in Mood.query.all()] == ['fine']
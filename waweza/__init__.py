@@ -1,29 +1,58 @@
-import os
+import click
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
-from flask_mail import Mail, Message
-
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = ''
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-app.config['MAIL_SERVER'] = 'smtp.googlemail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = ''
-app.config['MAIL_PASSWORD'] = ''
-
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-login_manager = LoginManager(app)
-mail = Mail(app)
-
-from waweza.routes import goal_bp, habit_bp, mood_bp, analytics_bp
-from waweza.errors.handlers import errors
-app.register_blueprint(goal_bp)
-app.register_blueprint(habit_bp)
-app.register_blueprint(mood_bp)
-app.register_blueprint(analytics_bp)
-app.register_blueprint(errors)
\ No newline at end of file
+from waweza.mailqueue import MailQueue
+from waweza.passwords import PasswordHasher
+from waweza import storage
+
+
+db = storage.Database()
+password_hasher = PasswordHasher()
+login_manager = LoginManager()
+mail_queue = MailQueue()
+
+
+def create_app(config=None):
+    # `config` is a mapping or an object whose settings override waweza.config.Config
+    app = Flask(__name__)
+    app.config.from_object('waweza.config.Config')
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    storage.init_app(app)
+    db.init_app(app)
+    password_hasher.init_app(app)
+    login_manager.init_app(app)
+    mail_queue.init_app(app)
+
+    # Only the `flask db` commands need Flask-Migrate, and alembic is slow to import,
+    # so web workers and tests skip it
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db, render_as_batch=True)
+
+    from waweza.routes import main_bp, goal_bp, habit_bp, mood_bp, analytics_bp, transfer_bp
+    from waweza.errors.handlers import errors
+    from waweza import rollups, cache, identity, scoping, ingest, responses, assets, templating, utils, transfer, instrumentation
+    app.register_blueprint(main_bp)
+    app.register_blueprint(goal_bp)
+    app.register_blueprint(habit_bp)
+    app.register_blueprint(mood_bp)
+    app.register_blueprint(analytics_bp)
+    app.register_blueprint(transfer_bp)
+    app.register_blueprint(errors)
+
+    rollups.init_app(app)
+    cache.init_app(app)
+    identity.init_app(app)
+    scoping.init_app(app)
+    ingest.init_app(app)
+    responses.init_app(app)
+    assets.init_app(app)
+    templating.init_app(app)
+    utils.init_app(app)
+    transfer.init_app(app)
+    instrumentation.init_app(app)
+    return app
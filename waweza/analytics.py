@@ -0,0 +1,168 @@
+from datetime import datetime, date, timedelta
+from sqlalchemy import select, type_coerce
+from waweza import db
+from waweza.models import Goal, Habit, HabitLog, MoodType, MoodDailyRollup
+
+# Mood on the days after a habit is done, up to this many days later
+MAX_LAG = 3
+ROLLING_WINDOWS = (7, 30)
+MIN_PAIRS = 5
+EPOCH = date(1970, 1, 1)
+
+
+def _pearson(np, x, y, min_pairs=MIN_PAIRS):
+    # Pearson r between every column of x (days x a) and every column of y (days x b),
+    # each pair over the days where both are known (not NaN). Returns an a x b array with
+    # NaN where there are fewer than `min_pairs` days or no variance.
+    mx, my = ~np.isnan(x), ~np.isnan(y)
+    x0, y0 = np.where(mx, x, 0.0), np.where(my, y, 0.0)
+    mx, my = mx.astype(float), my.astype(float)
+
+    n = mx.T @ my
+    sx, sy = x0.T @ my, mx.T @ y0
+    sxx, syy = (x0 * x0).T @ my, mx.T @ (y0 * y0)
+    sxy = x0.T @ y0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sy / n
+        var = (sxx - sx * sx / n) * (syy - sy * sy / n)
+        r = cov / np.sqrt(var)
+    r[(n < min_pairs) | ~(var > 1e-12)] = np.nan
+    return r
+
+def _rolling_rate(np, matrix, window):
+    # Share of tracked days completed over the trailing `window` days, per day and column.
+    # The first days use the shorter history they have.
+    zeros = np.zeros((1, matrix.shape[1]))
+    done = np.vstack([zeros, np.cumsum(np.nan_to_num(matrix), axis=0)])
+    tracked = np.vstack([zeros, np.cumsum(~np.isnan(matrix), axis=0)])
+    ends = np.arange(1, len(matrix) + 1)
+    begins = np.maximum(ends - window, 0)
+    done, tracked = done[ends] - done[begins], tracked[ends] - tracked[begins]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(tracked > 0, done / tracked, np.nan)
+
+def _value(value, digits=3):
+    return None if value != value else round(float(value), digits)
+
+def build_matrices(user_id, today=None):
+    # The user's full history as a day x habit completion matrix (1 done, 0 logged or missed,
+    # NaN before the habit was tracked) and a day x MoodType matrix of each mood's share of
+    # the day's moods (NaN on days without moods), both starting at the first logged day
+    import numpy as np
+
+    today = today or datetime.utcnow().date()
+    habits = db.session.query(Habit.id, Habit.name, Habit.goal_id, Habit.created_at).filter(
+        Habit.user_id == user_id
+    ).order_by(Habit.id).all()
+    # Thousands of rows per year: skip the ORM and the per-row date and boolean conversion,
+    # and let NumPy parse the days as the driver returns them (ISO strings on SQLite)
+    logs = db.session.connection().execute(
+        select(HabitLog.habit_id, type_coerce(HabitLog.day, db.String), type_coerce(HabitLog.completed, db.Integer))
+        .join(Habit).where(Habit.user_id == user_id, HabitLog.day <= today)
+    ).all()
+    moods = db.session.connection().execute(
+        select(type_coerce(MoodDailyRollup.day, db.String), MoodDailyRollup.mood_type, MoodDailyRollup.count)
+        .where(MoodDailyRollup.user_id == user_id, MoodDailyRollup.day <= today)
+    ).all()
+    log_habits, log_days, log_completed = zip(*logs) if logs else ((), (), ())
+    mood_days, mood_types, mood_counts = zip(*moods) if moods else ((), (), ())
+
+    # Days are counted from 1970-01-01
+    log_days = np.array(log_days, dtype='datetime64[D]').astype(np.int64)
+    mood_days = np.array(mood_days, dtype='datetime64[D]').astype(np.int64)
+    created = np.array([created_at.date() for _, _, _, created_at in habits], dtype='datetime64[D]').astype(np.int64)
+    last = (today - EPOCH).days
+    known = [days.min() for days in (log_days, mood_days, created) if len(days)]
+    first = min(min(known), last) if known else last
+    days = last - first + 1
+
+    log_rows = log_days - first
+    # Habits are ordered by id, so a binary search finds each log's column
+    habit_ids = np.array([habit_id for habit_id, _, _, _ in habits], dtype=np.int64)
+    log_columns = np.searchsorted(habit_ids, np.array(log_habits, dtype=np.int64))
+    completions = np.zeros((days, len(habits)))
+    completions[log_rows, log_columns] = np.array(log_completed, dtype=float)
+
+    # A habit is tracked from its creation or its first log, whichever is earlier
+    starts = created - first
+    if len(logs):
+        np.minimum.at(starts, log_columns, log_rows)
+    completions[np.arange(days)[:, None] < starts[None, :]] = np.nan
+
+    mood_index = {mood_type: n for n, mood_type in enumerate(MoodType)}
+    counts = np.zeros((days, len(mood_index)))
+    mood_columns = np.array([mood_index[mood_type] for mood_type in mood_types], dtype=np.int64)
+    np.add.at(counts, (mood_days - first, mood_columns), mood_counts)
+    totals = counts.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mood_shares = np.where(totals > 0, counts / totals, np.nan)
+    # Mean score of the day on the chart scale (1 for the first MoodType)
+    mood_scores = mood_shares @ np.arange(1, len(mood_index) + 1)
+
+    return {
+        'first_day': EPOCH + timedelta(days=int(first)),
+        'habits': habits,
+        'completions': completions,
+        'mood_shares': mood_shares,
+        'mood_scores': mood_scores
+    }
+
+def get_correlations(user_id, start, end, today=None):
+    # Habit/mood correlations over the full history, rolling completion rates for
+    # [start, end] and each habit's share of its goal's completions
+    import numpy as np
+
+    matrices = build_matrices(user_id, today)
+    habits, completions = matrices['habits'], matrices['completions']
+    scores, shares = matrices['mood_scores'], matrices['mood_shares']
+    first_day = matrices['first_day']
+    names = [name for _, name, _, _ in habits]
+    if not habits:
+        return {'habits': [], 'goals': [], 'rolling': {'window': ROLLING_WINDOWS[0], 'dates': [], 'rates': []}}
+
+    # Same-day correlation with the mood score and with each mood type, then the score
+    # `lag` days after the habit
+    same_day = _pearson(np, completions, np.column_stack([scores, shares]))
+    lagged = [_pearson(np, completions[:-lag], scores[lag:, None])[:, 0] if len(scores) > lag
+              else np.full(len(habits), np.nan) for lag in range(1, MAX_LAG + 1)]
+
+    rolling = {window: _rolling_rate(np, completions, window) for window in ROLLING_WINDOWS}
+    done = np.nansum(completions, axis=0)
+
+    # Each habit's share of its goal's completions, from a goal x habit membership matrix
+    goals = db.session.query(Goal.id, Goal.title).filter(Goal.user_id == user_id).order_by(Goal.id).all()
+    goal_row = {goal_id: n for n, (goal_id, _) in enumerate(goals)}
+    membership = np.zeros((len(goals), len(habits)))
+    membership[[goal_row[goal_id] for _, _, goal_id, _ in habits], np.arange(len(habits))] = 1
+    goal_done = membership @ done
+    with np.errstate(divide='ignore', invalid='ignore'):
+        contribution = np.where(goal_done[:, None] > 0, membership * done / goal_done[:, None], 0)
+
+    # Overall completion rate of each day, then its rolling mean over the window's days
+    tracked = np.sum(~np.isnan(completions), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily = np.where(tracked > 0, np.nansum(completions, axis=1) / tracked, np.nan)
+    overall = _rolling_rate(np, daily[:, None], ROLLING_WINDOWS[0])[:, 0]
+    window_rows = np.arange((start - first_day).days, (end - first_day).days + 1)
+
+    return {
+        'habits': [{
+            'name': names[n],
+            'completed': int(done[n]),
+            'mood_correlation': _value(same_day[n, 0]),
+            'mood_type_correlation': {mood_type.value: _value(same_day[n, k + 1])
+                                      for k, mood_type in enumerate(MoodType)},
+            'lagged_mood_correlation': [_value(r[n]) for r in lagged],
+            'rolling_rate': {f'{window}d': _value(rates[-1, n]) for window, rates in rolling.items()}
+        } for n in range(len(habits))],
+        'goals': [{
+            'title': title,
+            'completed': int(goal_done[g]),
+            'contribution': {names[n]: _value(contribution[g, n]) for n in np.flatnonzero(membership[g])}
+        } for g, (_, title) in enumerate(goals)],
+        'rolling': {
+            'window': ROLLING_WINDOWS[0],
+            'dates': [(start + timedelta(days=i)).isoformat() for i in range(len(window_rows))],
+            'rates': [_value(overall[row]) if 0 <= row < len(overall) else None for row in window_rows]
+        }
+    }
@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import gzip
+import hashlib
+import mimetypes
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+DIST = 'dist'
+# Uploaded pictures have their own pipeline and the build output is not an input
+SKIP_DIRS = (DIST, 'profile_pics')
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.map'}
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+# Listed from the smallest files to the largest, which is the order browsers should try them
+IMAGE_FORMATS = {
+    'avif': ('AVIF', 'image/avif', {'quality': 55}),
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 6})
+}
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+CSS_URL = re.compile(r"url\((['\"]?)([^'\")]+)\1\)")
+CSS_BACKGROUND = re.compile(r"^(\s*)background-image:\s*url\((['\"]?)([^'\")]+)\2\)\s*;", re.MULTILINE)
+
+for _, mimetype, _ in IMAGE_FORMATS.values():
+    mimetypes.add_type(mimetype, '.' + mimetype.split('/')[1])
+
+
+def _fingerprint(name, data):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+def _write(static_folder, name, data):
+    path = os.path.join(static_folder, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+def _precompress(static_folder, name, data, min_size):
+    if len(data) < min_size:
+        return
+    _write(static_folder, name + ENCODINGS['gzip'], gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    _write(static_folder, name + ENCODINGS['br'], brotli.compress(data, quality=11))
+
+def image_formats():
+    # The IMAGE_FORMATS this Pillow can write; AVIF needs a plugin many builds lack
+    from PIL import Image
+    Image.init()
+    return [fmt for fmt, (pil_format, _, _) in IMAGE_FORMATS.items() if pil_format in Image.SAVE]
+
+def _image_variants(static_folder, name, data, widths):
+    # WebP and AVIF copies of an image at each width up to its own, in the formats Pillow can write
+    from io import BytesIO
+    from PIL import Image
+    image = Image.open(BytesIO(data))
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    stem, _ = os.path.splitext(name)
+    # A width within 10% of the original adds a file but saves next to nothing
+    sizes = sorted({width for width in widths if width * 10 < image.width * 9} | {image.width})
+
+    variants = {}
+    for fmt in image_formats():
+        pil_format, _, options = IMAGE_FORMATS[fmt]
+        variants[fmt] = []
+        for width in sizes:
+            resized = image if width == image.width else image.resize(
+                (width, round(image.height * width / image.width)), Image.LANCZOS)
+            out = BytesIO()
+            resized.save(out, format=pil_format, **options)
+            variant = _fingerprint(f'{DIST}/{stem}-{width}w.{fmt}', out.getvalue())
+            _write(static_folder, variant, out.getvalue())
+            variants[fmt].append([width, variant])
+    return variants
+
+def _rewrite_css(css, css_name, manifest):
+    # Point url() references at the fingerprinted files, and give background images an
+    # image-set() with the AVIF/WebP variants that browsers without support ignore
+    base = os.path.dirname(css_name)
+
+    def resolve(url):
+        return os.path.normpath(os.path.join(base, url)).replace(os.sep, '/')
+
+    def relative(path):
+        return os.path.relpath(path, os.path.join(DIST, base)).replace(os.sep, '/')
+
+    def background(match):
+        indent, quote, url = match.groups()
+        declaration = match.group(0)
+        variants = manifest['images'].get(resolve(url))
+        if not variants:
+            return declaration
+        sources = [f'url("{relative(variants[fmt][-1][1])}") type("{IMAGE_FORMATS[fmt][1]}")'
+                   for fmt in IMAGE_FORMATS if fmt in variants]
+        fallback = manifest['files'][resolve(url)]
+        sources.append(f'url("{relative(fallback)}") type("{mimetypes.guess_type(fallback)[0]}")')
+        return f"{declaration}\n{indent}background-image: image-set({', '.join(sources)});"
+
+    def url(match):
+        quote, target = match.groups()
+        path = manifest['files'].get(resolve(target))
+        if path is None or ':' in target or target.startswith('/'):
+            return match.group(0)
+        return f'url({quote}{relative(path)}{quote})'
+
+    return CSS_URL.sub(url, CSS_BACKGROUND.sub(background, css))
+
+def build_assets(static_folder, widths, min_size):
+    # Copy every static file to dist/ under a content-hashed name, with .gz/.br copies of
+    # text files and AVIF/WebP variants of images, and write the manifest that maps them
+    manifest = {'files': {}, 'images': {}}
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        rel_root = os.path.relpath(root, static_folder)
+        if rel_root != '.' and rel_root.replace(os.sep, '/').split('/')[0] in SKIP_DIRS:
+            dirs[:] = []
+            continue
+        for filename in sorted(files):
+            name = os.path.normpath(os.path.join(rel_root, filename)).replace(os.sep, '/')
+            sources.append(name)
+
+    # Stylesheets go last so their url()s can be rewritten to the names chosen above
+    for name in sorted(sources, key=lambda name: name.endswith('.css')):
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            data = f.read()
+        ext = os.path.splitext(name)[1].lower()
+        if ext == '.css':
+            data = _rewrite_css(data.decode('utf-8'), name, manifest).encode('utf-8')
+        if ext in IMAGE_EXTENSIONS:
+            manifest['images'][name] = _image_variants(static_folder, name, data, widths)
+        target = _fingerprint(f'{DIST}/{name}', data)
+        _write(static_folder, target, data)
+        if ext in COMPRESSIBLE:
+            _precompress(static_folder, target, data, min_size)
+        manifest['files'][name] = target
+
+    _write(static_folder, f'{DIST}/manifest.json', json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+def load_manifest(app):
+    try:
+        with open(app.config['STATIC_MANIFEST']) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _manifest():
+    return current_app.extensions['waweza_assets']
+
+def _fingerprinted_url(endpoint, values):
+    # url_for('static', filename=...) resolves to the built copy when there is one
+    manifest = _manifest()
+    if endpoint == 'static' and manifest is not None:
+        path = manifest['files'].get(values.get('filename'))
+        if path is not None:
+            values['filename'] = path
+
+def image_sources(filename):
+    # <source> attributes for the AVIF/WebP variants of a static image, best format first
+    manifest = _manifest()
+    variants = manifest['images'].get(filename) if manifest else None
+    if not variants:
+        return []
+    return [{
+        'type': IMAGE_FORMATS[fmt][1],
+        'srcset': ', '.join(f"{url_for('static', filename=path)} {width}w" for width, path in variants[fmt])
+    } for fmt in IMAGE_FORMATS if fmt in variants]
+
+def serve_static(filename):
+    # Built files never change under the same name: cache them for a year, and send the
+    # precompressed copy the client accepts
+    app = current_app
+    if not filename.startswith(DIST + '/'):
+        return app.send_static_file(filename)
+
+    path = os.path.join(app.static_folder, filename)
+    available = [encoding for encoding, suffix in ENCODINGS.items() if os.path.isfile(path + suffix)]
+    encoding = request.accept_encodings.best_match(available) if available else None
+    response = send_from_directory(app.static_folder, filename + (ENCODINGS[encoding] if encoding else ''),
+                                   mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=app.config['STATIC_IMMUTABLE_MAX_AGE'])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if available:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Fingerprint, precompress and convert the static assets."""
+    app = current_app._get_current_object()
+    manifest = build_assets(app.static_folder, app.config['STATIC_IMAGE_WIDTHS'], app.config['STATIC_COMPRESS_MIN_SIZE'])
+    app.extensions['waweza_assets'] = manifest
+    skipped = [fmt for fmt in IMAGE_FORMATS if fmt not in image_formats()]
+    if skipped:
+        click.echo(f"Pillow cannot write {', '.join(skipped)}; no such image variants were made.", err=True)
+    click.echo(f"Built {len(manifest['files'])} file(s) and variants of {len(manifest['images'])} image(s) "
+               f"into {os.path.join(app.static_folder, DIST)}.")
+
+def init_app(app):
+    app.config.setdefault('STATIC_MANIFEST', os.path.join(app.static_folder, DIST, 'manifest.json'))
+    app.config.setdefault('STATIC_IMAGE_WIDTHS', (480, 960, 1920))
+    app.config.setdefault('STATIC_COMPRESS_MIN_SIZE', 512)
+    app.config.setdefault('STATIC_IMMUTABLE_MAX_AGE', 365 * 24 * 3600)
+
+    # Without a build (development) the original files are served as before
+    app.extensions['waweza_assets'] = load_manifest(app)
+    app.view_functions['static'] = serve_static
+    app.url_defaults(_fingerprinted_url)
+    app.add_template_global(image_sources)
+    app.cli.add_command(build_assets_command)
@@ -0,0 +1,198 @@
+import os
+import time
+import pickle
+import secrets
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy.engine import make_url
+from waweza.storage import _is_memory
+
+
+class MemoryCache:
+    # Per-process LRU cache with a TTL. Entries and data versions are not shared between
+    # processes, so it is only correct for a single process: tests, or an in-memory
+    # database, which is private to its process anyway.
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+        # Versions restart from zero with the process, so keys also carry an epoch
+        self.epoch = secrets.token_hex(4)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+
+class SQLiteCache:
+    # LRU/TTL cache stored in a local SQLite file so every gunicorn worker shares it
+
+    def __init__(self, path, max_entries=1024, ttl=300, namespace=''):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                         '(key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries (accessed)')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+            conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('epoch', ?)", (int(time.time()),))
+        # Apps on different databases may share the file; their keys must never meet
+        self.epoch = f"{self.counter('epoch')}{namespace}"
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value, expires FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        now = time.time()
+        if expires < now:
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            return None
+        conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                     (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now + self.ttl, now))
+        conn.execute('DELETE FROM entries WHERE key IN '
+                     '(SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                     (self.max_entries,))
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def counter(self, name):
+        row = self._connect().execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, name):
+        conn = self._connect()
+        conn.execute('INSERT INTO counters (name, value) VALUES (?, 1) '
+                     'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+        return self.counter(name)
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute('DELETE FROM entries')
+        conn.execute("DELETE FROM counters WHERE name != 'epoch'")
+
+
+def get_cache():
+    return current_app.extensions['waweza_cache']
+
+def data_version(user_id):
+    return get_cache().counter(f'version:{user_id}')
+
+def bump_data_version(user_id):
+    # Called by the write routes; every cached entry of the user becomes stale at once
+    return get_cache().incr(f'version:{user_id}')
+
+def cache_key(namespace, user_id, *parts):
+    cache = get_cache()
+    version = cache.counter(f'version:{user_id}')
+    return ':'.join([namespace, cache.epoch, str(user_id), str(version)] + [str(part) for part in parts])
+
+def etag_for(key):
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def cached(key, compute, count=True):
+    # `count=False` for lookups nested in another one, so a request is counted once
+    cache = get_cache()
+    value = cache.get(key)
+    if value is not None:
+        if count:
+            cache.incr('hits')
+        return value
+    if count:
+        cache.incr('misses')
+    value = compute()
+    cache.set(key, value)
+    return value
+
+def cache_stats():
+    cache = get_cache()
+    hits, misses = cache.counter('hits'), cache.counter('misses')
+    return {
+        'backend': current_app.config['CACHE_BACKEND'],
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses) * 100, 2) if hits + misses else 0
+    }
+
+def init_app(app):
+    app.config.setdefault('CACHE_BACKEND', 'sqlite')
+    app.config.setdefault('CACHE_PATH', os.path.join(app.instance_path, 'cache.db'))
+    app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+    app.config.setdefault('CACHE_TTL', 300)
+
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    # An in-memory database belongs to one process, so its cache can too
+    if app.config['CACHE_BACKEND'] == 'sqlite' and _is_memory(url):
+        app.config['CACHE_BACKEND'] = 'memory'
+
+    if app.config['CACHE_BACKEND'] == 'sqlite':
+        os.makedirs(os.path.dirname(app.config['CACHE_PATH']), exist_ok=True)
+        database = url.render_as_string(hide_password=True)
+        cache = SQLiteCache(app.config['CACHE_PATH'],
+                            max_entries=app.config['CACHE_MAX_ENTRIES'],
+                            ttl=app.config['CACHE_TTL'],
+                            namespace='-' + hashlib.sha1(database.encode('utf-8')).hexdigest()[:8])
+    elif app.config['CACHE_BACKEND'] == 'memory':
+        cache = MemoryCache(max_entries=app.config['CACHE_MAX_ENTRIES'],
+                            ttl=app.config['CACHE_TTL'])
+    else:
+        raise ValueError(f"Unknown CACHE_BACKEND '{app.config['CACHE_BACKEND']}'")
+    app.extensions['waweza_cache'] = cache
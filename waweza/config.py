@@ -0,0 +1,37 @@
+import os
+
+
+def _env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config:
+    # Defaults for every deployment; each one can be overridden from the environment
+    SECRET_KEY = os.environ.get('SECRET_KEY', '')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///site.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DATABASE_READER_URL = os.environ.get('DATABASE_READER_URL')
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    SQLITE_READER_POOL_SIZE = int(os.environ.get('SQLITE_READER_POOL_SIZE', 4))
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))
+    PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', 2))
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.googlemail.com')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = _env_bool('MAIL_USE_TLS', True)
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME', '')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', '')
+    PER_PAGE = int(os.environ.get('PER_PAGE', 20))
+    MAX_PER_PAGE = int(os.environ.get('MAX_PER_PAGE', 100))
+    MOOD_CHART_DAYS = int(os.environ.get('MOOD_CHART_DAYS', 30))
+    MOOD_SERIES_MAX_POINTS = int(os.environ.get('MOOD_SERIES_MAX_POINTS', 366))
+    MAX_BATCH_LOGS = int(os.environ.get('MAX_BATCH_LOGS', 1000))
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'sqlite')
+    INGEST_BUFFER = _env_bool('INGEST_BUFFER', True)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    TEMPLATE_FRAGMENT_CACHE = _env_bool('TEMPLATE_FRAGMENT_CACHE', True)
+    SQL_INSTRUMENTATION = _env_bool('SQL_INSTRUMENTATION')
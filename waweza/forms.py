@@ -107,6 +107,10 @@ class HabitStatusForm(FlaskForm):
     notes = TextAreaField('Notes')
     submit = SubmitField('Update Status')
 
+class ImportForm(FlaskForm):
+    data_file = FileField('Export File (NDJSON)', validators=[DataRequired(), FileAllowed(['ndjson', 'jsonl', 'json'])])
+    submit = SubmitField('Import')
+
 class MoodForm(FlaskForm):
     date = DateField('Date', validators=[DataRequired()], default=date.today)
     mood_type = SelectField('Mood', choices=[(mood.name, mood.value) for mood in MoodType], validators=[DataRequired()])
@@ -1,52 +1,104 @@
-from datetime import datetime, timedelta
+import importlib
 from collections import Counter
-from waweza.models import Goal, Habit, HabitLog, Mood, StatusType, MoodType
-from sqlalchemy import func
-
-def get_week_range():
-    today = datetime.today()
-    start = today - timedelta(days=today.weekday())
-    end = start + timedelta(days=6)
-    return start, end
-
-def get_analytics_data():
-    start, end = get_week_range()
-    
-    goals = Goal.query.all()
-    habits = Habit.query.all()
-    habit_logs = HabitLog.query.filter(HabitLog.date >= start, HabitLog.date <= end).all()
-    moods = Mood.query.filter(Mood.date >= start, Mood.date <= end).all()
-
-    goal_progress = {goal.title: goal.status.value for goal in goals}
-    
-    habit_completion = {habit.name: sum(1 for log in habit.logs if log.completed and start <= log.date <= end) for habit in habits}
-    
-    mood_counter = Counter(mood.mood_type.value for mood in moods)
-    
-    goals_completed = sum(1 for goal in goals if goal.status == StatusType.COMPLETED) / len(goals) if goals else 0
-    
-    habit_completion_rate = sum(habit_completion.values()) / (len(habits) * 7) if habits else 0
-    
+from datetime import datetime, date, time, timedelta
+from waweza import db
+from waweza.models import Goal, Habit, HabitLog, Mood, StatusType, MoodType, HabitDailyRollup, MoodDailyRollup
+from waweza.rollups import as_day, get_rollup_totals, refresh_habit_rollups
+from sqlalchemy import func, select, null, or_, bindparam
+from sqlalchemy.orm import joinedload
+
+ANALYTICS_WINDOWS = ('week', 'month', 'quarter')
+# Chart score of each mood, 1 for the first MoodType
+MOOD_SCORES = {mood_type: number for number, mood_type in enumerate(MoodType, start=1)}
+
+def get_window_range(window='week', start=None, end=None, today=None):
+    # Resolve a named window or a custom 'YYYY-MM-DD' range into inclusive start/end dates
+    today = today or datetime.utcnow().date()
+    if start or end:
+        try:
+            start = date.fromisoformat(start) if start else today
+            end = date.fromisoformat(end) if end else today
+        except ValueError:
+            raise ValueError('Dates must be in YYYY-MM-DD format.')
+        if end < start:
+            raise ValueError('End date must be after start date.')
+        if (end - start).days >= 366:
+            raise ValueError('The analytics window cannot be longer than a year.')
+        return start, end
+
+    if window == 'week':
+        start = today - timedelta(days=today.weekday())
+        return start, start + timedelta(days=6)
+    if window == 'month':
+        start = today.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    if window == 'quarter':
+        start = today.replace(month=(today.month - 1) // 3 * 3 + 1, day=1)
+        next_quarter = (start + timedelta(days=95)).replace(day=1)
+        return start, next_quarter - timedelta(days=1)
+    raise ValueError(f"Unknown window '{window}', expected one of {', '.join(ANALYTICS_WINDOWS)}.")
+
+def get_analytics_data(user_id, start=None, end=None):
+    if start is None or end is None:
+        start, end = get_window_range()
+    days = (end - start).days + 1
+    totals = get_rollup_totals(user_id, start, end)
+
+    goals = db.session.query(Goal.title, Goal.status).filter(Goal.user_id == user_id).all()
+
+    # Completed logs per habit inside the window, counted by the database
+    habit_rows = db.session.query(Habit.name, func.count(HabitLog.id)).outerjoin(
+        HabitLog,
+        (HabitLog.habit_id == Habit.id) &
+        (HabitLog.completed == True) &
+        (HabitLog.day >= start) &
+        (HabitLog.day <= end)
+    ).filter(Habit.user_id == user_id).group_by(Habit.id, Habit.name).order_by(Habit.id).all()
+
+    moods = db.session.query(Mood.day, Mood.mood_type).filter(
+        Mood.user_id == user_id,
+        Mood.day >= start,
+        Mood.day <= end
+    ).order_by(Mood.id).all()
+
+    goal_progress = {title: status.value for title, status in goals}
+
+    habit_completion = {name: completed for name, completed in habit_rows}
+
+    # Keep the counts in order of first appearance so ties resolve as they always have
+    mood_counter = {mood_type.value: 0 for _, mood_type in moods}
+    mood_counter.update(totals['moods'])
+
+    goals_completed = sum(1 for _, status in goals if status == StatusType.COMPLETED) / len(goals) if goals else 0
+
+    habit_completion_rate = totals['completed'] / (len(habit_rows) * days) if habit_rows else 0
+
     most_common_mood = max(mood_counter, key=mood_counter.get, default=None)
-    
+
     mood_trend = 'Stable'
-    if moods:
-        mood_values = [mood.mood_type.value for mood in moods]
-        if len(mood_values) > 1:
-            if mood_values[-1] > mood_values[0]:
-                mood_trend = 'Improving'
-            elif mood_values[-1] < mood_values[0]:
-                mood_trend = 'Declining'
+    if len(moods) > 1:
+        first, last = moods[0][1].value, moods[-1][1].value
+        if last > first:
+            mood_trend = 'Improving'
+        elif last < first:
+            mood_trend = 'Declining'
 
+    # First mood logged on each day, looked up by day instead of rescanning the list
+    first_mood_by_day = {}
+    for day, mood_type in moods:
+        first_mood_by_day.setdefault(day, mood_type.value)
+    window_days = [start + timedelta(days=i) for i in range(days)]
     mood_over_time = {
-        'dates': [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)],
-        'values': [next((mood.mood_type.value for mood in moods if mood.date.date() == (start + timedelta(days=i)).date()), None) for i in range(7)]
+        'dates': [day.strftime('%Y-%m-%d') for day in window_days],
+        'values': [first_mood_by_day.get(day) for day in window_days]
     }
 
+    habit_rates = [completed / days for _, completed in habit_rows]
     goal_habit_correlation = [
-        {'x': goal.status.value, 'y': sum(1 for log in habit.logs if log.completed and start <= log.date <= end) / 7}
-        for goal in goals
-        for habit in habits
+        {'x': status.value, 'y': rate}
+        for _, status in goals
+        for rate in habit_rates
     ]
 
     return {
@@ -61,28 +113,399 @@ def get_analytics_data():
         'goal_habit_correlation': goal_habit_correlation
     }
 
+def get_completion_days(user_id):
+    # Fetch every completed day for each of the user's habits in a single query.
+    # The outer join keeps habits that have never been completed.
+    rows = db.session.query(Habit.id, HabitLog.day).outerjoin(
+        HabitLog, (HabitLog.habit_id == Habit.id) & (HabitLog.completed == True)
+    ).filter(Habit.user_id == user_id).distinct().all()
+
+    completion_days = {}
+    for habit_id, day in rows:
+        days = completion_days.setdefault(habit_id, set())
+        if day is not None:
+            days.add(day)
+    return completion_days
+
+def _streak_lengths(days, today):
+    # Returns (current, longest) for a set of days in one pass over the sorted days
+    current = longest = run = 0
+    previous = None
+    for day in sorted(days):
+        if day > today:
+            break
+        run = run + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, run)
+        previous = day
+    if previous == today:
+        current = run
+    return current, longest
+
+def get_habit_streaks(user_id, today=None):
+    today = today or datetime.utcnow().date()
+    completion_days = get_completion_days(user_id)
+
+    habit_streaks = {}
+    for habit_id, days in completion_days.items():
+        current, longest = _streak_lengths(days, today)
+        habit_streaks[habit_id] = {'current': current, 'longest': longest}
+
+    # A day counts towards the overall streak only if all habits were completed that day
+    all_completed = set.intersection(*completion_days.values()) if completion_days else set()
+    current, longest = _streak_lengths(all_completed, today)
+
+    return {
+        'current': current,
+        'longest': longest,
+        'habits': habit_streaks
+    }
+
 def calculate_habit_streak(user_id):
-    current_date = datetime.utcnow().date()
-    streak = 0
-    
-    # Query to get all user's habits
-    habits = Habit.query.filter_by(user_id=user_id).all()
-    
-    if not habits:
-        return 0
-    
-    while True:
-        # Check if all habits were completed for the current date
-        completed_habits = HabitLog.query.filter(
-            HabitLog.habit_id.in_([h.id for h in habits]),
-            func.date(HabitLog.date) == current_date,
-            HabitLog.completed == True
-        ).count()
-        
-        if completed_habits == len(habits):
-            streak += 1
-            current_date -= timedelta(days=1)
+    return get_habit_streaks(user_id)['current']
+
+
+HOME_MOOD_DAYS = 7
+
+def get_home_summary(user_id, today=None):
+    # Every figure on /home from two queries: one row of counts, then the recent mood
+    # rollups together with the rollup days that can still be part of the current streak
+    today = today or datetime.utcnow().date()
+
+    def count(query):
+        return query.with_entities(func.count()).scalar_subquery()
+
+    goals = Goal.query.filter(Goal.user_id == user_id)
+    habits = Habit.query.filter(Habit.user_id == user_id)
+    habits_count = count(habits)
+    counts = db.session.query(
+        count(goals.filter(Goal.status == StatusType.NOTSTARTED)),
+        count(goals.filter(Goal.status == StatusType.STARTED)),
+        count(goals.filter(Goal.status == StatusType.COMPLETED)),
+        habits_count,
+        count(HabitLog.query.join(Habit).filter(
+            Habit.user_id == user_id, HabitLog.day == today, HabitLog.completed == True))
+    ).one()
+    not_started, started, completed, habit_total, completed_today = counts
+
+    # A day completes the overall streak when every habit has a completed log, which the
+    # rollup counts directly now that a habit has one log per day. Days up to the last
+    # incomplete one cannot reach today, so they are not fetched.
+    last_break = db.session.query(func.max(HabitDailyRollup.day)).filter(
+        HabitDailyRollup.user_id == user_id,
+        HabitDailyRollup.day <= today,
+        HabitDailyRollup.completed < habits_count
+    ).scalar_subquery()
+    moods = select(MoodDailyRollup.day, MoodDailyRollup.mood_type, MoodDailyRollup.count).where(
+        MoodDailyRollup.user_id == user_id,
+        MoodDailyRollup.day > today - timedelta(days=HOME_MOOD_DAYS),
+        MoodDailyRollup.day <= today
+    )
+    streak_days = select(HabitDailyRollup.day, null(), HabitDailyRollup.completed).where(
+        HabitDailyRollup.user_id == user_id,
+        HabitDailyRollup.day <= today,
+        HabitDailyRollup.completed >= habits_count,
+        HabitDailyRollup.completed > 0,
+        or_(last_break.is_(None), HabitDailyRollup.day > last_break)
+    )
+    rows = db.session.execute(moods.union_all(streak_days)).all()
+
+    mood_days, full_days = {}, set()
+    for day, mood_type, n in rows:
+        day = as_day(day)
+        if mood_type is None:
+            full_days.add(day)
         else:
-            break
-    
-    return streak
\ No newline at end of file
+            totals = mood_days.setdefault(day, [0, 0])
+            totals[0] += MOOD_SCORES[mood_type] * n
+            totals[1] += n
+
+    mood_dates = sorted(mood_days)
+    mood_values = [round(mood_days[day][0] / mood_days[day][1], 2) for day in mood_dates]
+    mood_total = sum(n for _, n in mood_days.values())
+    mood_average = sum(total for total, _ in mood_days.values()) / mood_total if mood_total else 0
+    goal_total = not_started + started + completed
+    goal_completion_rate = completed / goal_total * 100 if goal_total else 0
+
+    return {
+        'goals_count': started,
+        'completed_goals_count': completed,
+        'goal_status_counts': {
+            StatusType.NOTSTARTED.value: not_started,
+            StatusType.STARTED.value: started,
+            StatusType.COMPLETED.value: completed
+        },
+        'habits_count': habit_total,
+        'habits_completed_today': completed_today,
+        'mood_dates': [day.isoformat() for day in mood_dates],
+        'mood_values': mood_values,
+        'mood_average': round(mood_average, 1),
+        'goal_completion_rate': round(goal_completion_rate, 1),
+        'habit_streak': _streak_lengths(full_days, today)[0]
+    }
+
+def get_goal_choices(user_id):
+    goals = db.session.query(Goal.id, Goal.title).filter(Goal.user_id == user_id).order_by(Goal.id)
+    return [(goal_id, title) for goal_id, title in goals]
+
+def get_habit_listing(user_id, today=None):
+    # The user's habits with their goals, joined in the same query
+    habits = Habit.query.options(joinedload(Habit.goal)).filter(
+        Habit.user_id == user_id
+    ).order_by(Habit.id).all()
+
+    # Today's status of every habit in one batched query
+    today = today or datetime.utcnow().date()
+    completed_today = dict(db.session.query(HabitLog.habit_id, HabitLog.completed).join(Habit).filter(
+        Habit.user_id == user_id,
+        HabitLog.day == today
+    ).all())
+
+    return [(habit, completed_today.get(habit.id, False)) for habit in habits]
+
+def get_mood_chart(user_id, days):
+    # Chart points for the last `days` days only, read straight from the (user_id, day) index
+    since = datetime.utcnow().date() - timedelta(days=days)
+    moods = db.session.query(Mood.date, Mood.mood_type).filter(
+        Mood.user_id == user_id,
+        Mood.day >= since
+    ).order_by(Mood.date, Mood.id).all()
+
+    dates = [mood_date.strftime('%Y-%m-%d') for mood_date, _ in moods]
+    mood_values = [MOOD_SCORES[mood_type] for _, mood_type in moods]
+    return dates, mood_values
+
+MOOD_BUCKETS = ('auto', 'raw', 'day', 'week', 'month')
+EPOCH = datetime(1970, 1, 1)
+
+def _bucket_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+def _bucket_count(start, end, bucket):
+    if bucket == 'day':
+        return (end - start).days + 1
+    if bucket == 'week':
+        return (_bucket_start(end, 'week') - _bucket_start(start, 'week')).days // 7 + 1
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+def downsample_lttb(points, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, from each bucket
+    # in between, the point that forms the largest triangle with its neighbours, so peaks
+    # survive. `points` are (x, y) pairs sorted by x.
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # The average of the next bucket is the third corner of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(points))
+        next_bucket = points[next_start:next_end]
+        avg_x = sum(x for x, _ in next_bucket) / len(next_bucket)
+        avg_y = sum(y for _, y in next_bucket) / len(next_bucket)
+
+        ax, ay = points[a]
+        best, best_area = None, -1
+        for n in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[n]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = n, area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+def parse_mood_series_args(args, today=None):
+    # Resolve ?start=&end=&bucket=&points= into get_mood_series arguments; no start means
+    # from the first mood
+    today = today or datetime.utcnow().date()
+    try:
+        start = date.fromisoformat(args['start']) if args.get('start') else None
+        end = date.fromisoformat(args['end']) if args.get('end') else today
+    except ValueError:
+        raise ValueError('Dates must be in YYYY-MM-DD format.')
+    if start and end < start:
+        raise ValueError('End date must be after start date.')
+    bucket = args.get('bucket', 'auto')
+    if bucket not in MOOD_BUCKETS:
+        raise ValueError(f"Unknown bucket '{bucket}', expected one of {', '.join(MOOD_BUCKETS)}.")
+    try:
+        points = int(args['points']) if args.get('points') else None
+    except ValueError:
+        raise ValueError('points must be a number.')
+    # Downsampling keeps the first and last point, so fewer than 3 is not a series
+    if points is not None and points < 3:
+        raise ValueError('points must be at least 3.')
+    return start, end, bucket, points
+
+def get_mood_series(user_id, start, end, bucket='auto', points=None, max_points=366):
+    # Mood counts per MoodType and the mean score per day, week or month bucket, summed from
+    # the daily rollups. 'raw' returns one point per mood, downsampled to `points`, and
+    # 'auto' picks the finest bucket that fits in `max_points`.
+    points = max(3, min(points or max_points, max_points))
+    if start is None:
+        first = db.session.query(func.min(MoodDailyRollup.day)).filter(MoodDailyRollup.user_id == user_id).scalar()
+        start = as_day(first) if first is not None else end
+    if start > end:
+        start = end
+
+    if bucket == 'raw':
+        moods = db.session.query(Mood.date, Mood.mood_type).filter(
+            Mood.user_id == user_id,
+            Mood.day >= start,
+            Mood.day <= end
+        ).order_by(Mood.date, Mood.id).all()
+        series = downsample_lttb([((mood_date - EPOCH).total_seconds(), MOOD_SCORES[mood_type])
+                                  for mood_date, mood_type in moods], points)
+        return {
+            'bucket': 'raw',
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'total': len(moods),
+            'points': [{'date': (EPOCH + timedelta(seconds=x)).isoformat(), 'score': score} for x, score in series]
+        }
+
+    if bucket == 'auto':
+        bucket = next((b for b in ('day', 'week', 'month') if _bucket_count(start, end, b) <= points), 'month')
+    if _bucket_count(start, end, bucket) > max_points:
+        raise ValueError(f'The range has more than {max_points} {bucket} buckets; use a coarser bucket.')
+
+    rows = db.session.query(MoodDailyRollup.day, MoodDailyRollup.mood_type, MoodDailyRollup.count).filter(
+        MoodDailyRollup.user_id == user_id,
+        MoodDailyRollup.day >= start,
+        MoodDailyRollup.day <= end
+    ).all()
+
+    buckets = {}
+    for day, mood_type, count in rows:
+        counts = buckets.setdefault(_bucket_start(as_day(day), bucket), Counter())
+        counts[mood_type] += count
+
+    series = []
+    for bucket_start in sorted(buckets):
+        counts = buckets[bucket_start]
+        total = sum(counts.values())
+        series.append({
+            'start': bucket_start.isoformat(),
+            'counts': {mood_type.value: counts[mood_type] for mood_type in MoodType},
+            'total': total,
+            'mean': round(sum(MOOD_SCORES[mood_type] * n for mood_type, n in counts.items()) / total, 2)
+        })
+    return {
+        'bucket': bucket,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'total': sum(item['total'] for item in series),
+        'series': series
+    }
+
+UPSERT_CHUNK_SIZE = 150
+UPSERT_DIALECTS = ('sqlite', 'postgresql')
+
+def habit_log_row(habit_id, day, completed, notes=None):
+    # A habit_log row for a whole day, shaped for upsert_habit_logs
+    return {
+        'habit_id': habit_id,
+        'date': datetime.combine(day, time()),
+        'day': day,
+        'completed': bool(completed),
+        'notes': notes or None
+    }
+
+def upsert_habit_logs(rows):
+    # Insert or update habit logs, keyed on (habit_id, day), with INSERT ... ON CONFLICT.
+    # Notes are only replaced when new ones are given. The caller commits.
+    # A statement may not touch the same row twice, so the last row for a key wins
+    rows = list({(row['habit_id'], row['day']): row for row in rows}.values())
+    name = db.engine.dialect.name
+    if name not in UPSERT_DIALECTS:
+        return _merge_habit_logs(rows)
+    dialect = importlib.import_module(f'sqlalchemy.dialects.{name}')
+
+    table = HabitLog.__table__
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = dialect.insert(table).values(rows[i:i + UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.habit_id, table.c.day],
+            set_={
+                'date': stmt.excluded.date,
+                'completed': stmt.excluded.completed,
+                'notes': func.coalesce(stmt.excluded.notes, table.c.notes)
+            }
+        )
+        db.session.execute(stmt)
+    return len(rows)
+
+def _merge_habit_logs(rows):
+    # The same upsert for databases without ON CONFLICT: existing logs are looked up and
+    # updated, the rest inserted. Unlike ON CONFLICT this is not atomic, so a concurrent
+    # insert of the same day fails on the unique index instead of merging.
+    table = HabitLog.__table__
+    update = table.update().where(table.c.id == bindparam('log_id')).values(
+        date=bindparam('log_date'),
+        completed=bindparam('log_completed'),
+        notes=func.coalesce(bindparam('log_notes'), table.c.notes)
+    )
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        chunk = rows[i:i + UPSERT_CHUNK_SIZE]
+        keys = {(row['habit_id'], row['day']) for row in chunk}
+        existing = {
+            (habit_id, day): log_id for log_id, habit_id, day in db.session.execute(
+                select(table.c.id, table.c.habit_id, table.c.day).where(
+                    table.c.habit_id.in_({habit_id for habit_id, _ in keys}),
+                    table.c.day.in_({day for _, day in keys})))
+            if (habit_id, day) in keys
+        }
+        updates = [{'log_id': existing[(row['habit_id'], row['day'])], 'log_date': row['date'],
+                    'log_completed': row['completed'], 'log_notes': row['notes']}
+                   for row in chunk if (row['habit_id'], row['day']) in existing]
+        inserts = [row for row in chunk if (row['habit_id'], row['day']) not in existing]
+        if updates:
+            db.session.execute(update, updates)
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+    return len(rows)
+
+def parse_batch_logs(payload, today=None):
+    # Entries of a batch logging request, as (habit_id, day, completed, notes) tuples.
+    # The payload either lists entries, or gives habit_ids and days to log every combination of.
+    today = today or datetime.utcnow().date()
+    if not isinstance(payload, dict):
+        raise ValueError('Expected a JSON object.')
+    try:
+        if 'entries' in payload:
+            entries = [(int(entry['habit_id']),
+                        date.fromisoformat(entry.get('day') or today.isoformat()),
+                        bool(entry.get('completed', True)),
+                        entry.get('notes'))
+                       for entry in payload['entries']]
+        else:
+            days = [date.fromisoformat(day) for day in payload.get('days') or [today.isoformat()]]
+            entries = [(int(habit_id), day, bool(payload.get('completed', True)), payload.get('notes'))
+                       for habit_id in payload.get('habit_ids') or [] for day in days]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Each entry needs a habit_id and an optional YYYY-MM-DD day.')
+    if not entries:
+        raise ValueError('Nothing to log.')
+    if any(day > today for _, day, _, _ in entries):
+        raise ValueError('Habits cannot be logged for future days.')
+    return entries
+
+def log_habits(user_id, entries):
+    # Record many habit logs of one user in one statement batch; returns the number of rows written.
+    # Raises ValueError when an entry names a habit the user does not own. The caller commits.
+    habit_ids = {habit_id for habit_id, _, _, _ in entries}
+    owned = {habit_id for habit_id, in db.session.query(Habit.id).filter(
+        Habit.user_id == user_id, Habit.id.in_(habit_ids))}
+    if owned != habit_ids:
+        raise ValueError(f'Unknown habits: {sorted(habit_ids - owned)}')
+
+    count = upsert_habit_logs([habit_log_row(*entry) for entry in entries])
+    refresh_habit_rollups(user_id, {day for _, day, _, _ in entries})
+    return count
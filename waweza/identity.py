@@ -0,0 +1,51 @@
+from flask import current_app
+from flask_login import UserMixin
+from waweza import db, login_manager
+from waweza.cache import MemoryCache
+from waweza.models import User
+
+
+class UserSnapshot(UserMixin):
+    # The fields of a User that views and templates read on every request. It is not
+    # bound to a session: views that change the account load the User row itself.
+    FIELDS = ('id', 'username', 'email', 'image_file', 'verified')
+
+    def __init__(self, id, username, email, image_file, verified):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.image_file = image_file
+        self.verified = verified
+
+    def __repr__(self):
+        return f"UserSnapshot('{self.id}', '{self.username}')"
+
+
+def _user_cache():
+    return current_app.extensions['waweza_user_cache']
+
+@login_manager.user_loader
+def load_user(user_id):
+    # Served from a small per-process cache; a miss reads only the snapshot columns
+    user_id = int(user_id)
+    cache = _user_cache()
+    snapshot = cache.get(user_id)
+    if snapshot is None:
+        row = db.session.query(*[getattr(User, field) for field in UserSnapshot.FIELDS]).filter(
+            User.id == user_id
+        ).first()
+        if row is None:
+            return None
+        snapshot = UserSnapshot(*row)
+        cache.set(user_id, snapshot)
+    return snapshot
+
+def invalidate_user(user_id):
+    # Called after a commit that changes a snapshot field. Other workers catch up within USER_CACHE_TTL.
+    _user_cache().delete(int(user_id))
+
+def init_app(app):
+    app.config.setdefault('USER_CACHE_SIZE', 1024)
+    app.config.setdefault('USER_CACHE_TTL', 60)
+    app.extensions['waweza_user_cache'] = MemoryCache(max_entries=app.config['USER_CACHE_SIZE'],
+                                                      ttl=app.config['USER_CACHE_TTL'])
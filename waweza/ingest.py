@@ -0,0 +1,361 @@
+import os
+import json
+import time
+import sqlite3
+import secrets
+import threading
+from collections import defaultdict
+from datetime import datetime, date
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+from flask_login import current_user
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from waweza import db
+from waweza.cache import bump_data_version
+from waweza.helpers import habit_log_row, upsert_habit_logs
+from waweza.models import Habit, Mood, MoodType, IngestCheckpoint
+from waweza.rollups import refresh_habit_rollups, refresh_mood_rollups
+from waweza.scoping import unscoped
+from waweza.storage import _is_memory
+
+KINDS = ('mood', 'habit_log')
+# Failures of the database rather than of the entries; they do not count as attempts
+TRANSIENT_ERRORS = (exc.OperationalError, exc.InterfaceError, exc.TimeoutError)
+
+
+def apply_writes(entries, source=None):
+    # Apply (staged_id, user_id, kind, data) entries to the main tables in one transaction,
+    # with one rollup refresh per user. With a `source`, entries at or below their user's
+    # checkpoint were applied before and are skipped, and the checkpoints move up in the
+    # same commit.
+    checkpoints = {}
+    if source is not None:
+        keys = {f'{source}:{user_id}': user_id for _, user_id, _, _ in entries}
+        checkpoints = {keys[checkpoint.source]: checkpoint for checkpoint in
+                       IngestCheckpoint.query.filter(IngestCheckpoint.source.in_(keys))}
+        for key, user_id in keys.items():
+            if user_id not in checkpoints:
+                checkpoints[user_id] = IngestCheckpoint(source=key, last_id=0)
+                db.session.add(checkpoints[user_id])
+        entries = [entry for entry in entries if entry[0] > checkpoints[entry[1]].last_id]
+    if not entries:
+        return set()
+
+    moods, logs = [], []
+    mood_days, habit_days = defaultdict(set), defaultdict(set)
+    for _, user_id, kind, data in entries:
+        day = date.fromisoformat(data['day'])
+        if kind == 'mood':
+            moods.append({'user_id': user_id, 'date': datetime.combine(day, datetime.min.time()), 'day': day,
+                          'mood_type': MoodType[data['mood_type']], 'notes': data.get('notes') or None})
+            mood_days[user_id].add(day)
+        else:
+            logs.append((user_id, habit_log_row(data['habit_id'], day, data['completed'], data.get('notes'))))
+
+    # A habit deleted while its logs were staged takes them with it
+    if logs:
+        owners = dict(db.session.query(Habit.id, Habit.user_id).filter(
+            Habit.id.in_({row['habit_id'] for _, row in logs})))
+        logs = [(user_id, row) for user_id, row in logs if owners.get(row['habit_id']) == user_id]
+        for user_id, row in logs:
+            habit_days[user_id].add(row['day'])
+        upsert_habit_logs([row for _, row in logs])
+    if moods:
+        db.session.execute(Mood.__table__.insert(), moods)
+
+    for user_id, days in habit_days.items():
+        refresh_habit_rollups(user_id, days)
+    for user_id, days in mood_days.items():
+        refresh_mood_rollups(user_id, days)
+    for staged_id, user_id, _, _ in entries:
+        if user_id in checkpoints:
+            checkpoints[user_id].last_id = max(checkpoints[user_id].last_id, staged_id)
+    db.session.commit()
+
+    users = set(habit_days) | set(mood_days)
+    for user_id in users:
+        bump_data_version(user_id)
+    return users
+
+
+class IngestBuffer:
+    # Write-behind buffer for mood and habit-log writes. Requests append to a staging table
+    # in a local SQLite file, shared by the workers of the host, and return. A background
+    # thread in each worker applies them to the main database in batches of up to
+    # INGEST_BATCH_SIZE, at most INGEST_MAX_LATENCY seconds after they were staged, in one
+    # transaction per batch. Only one worker applies at a time, holding a lease, so writes
+    # land in the order they were made.
+
+    def __init__(self, app, path, database):
+        self.app = app
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._staged = 0
+        self._nonce = secrets.token_hex(4)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS staged (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'user_id INTEGER NOT NULL, kind TEXT NOT NULL, data TEXT NOT NULL, created REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_staged_user_id ON staged (user_id)')
+            if 'attempts' not in {column[1] for column in conn.execute('PRAGMA table_info(staged)')}:
+                conn.execute('ALTER TABLE staged ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+            conn.execute('CREATE TABLE IF NOT EXISTS quarantined (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, '
+                         'kind TEXT NOT NULL, data TEXT NOT NULL, created REAL NOT NULL, attempts INTEGER NOT NULL, '
+                         'error TEXT, failed REAL NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT, expires REAL)')
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('source', ?)", (secrets.token_hex(8),))
+            conn.execute("INSERT OR IGNORE INTO meta (name, value, expires) VALUES ('lease', NULL, 0)")
+        # Staged ids start over with a new file, so the checkpoint is kept per file
+        self.source = self._connect().execute("SELECT value FROM meta WHERE name = 'source'").fetchone()[0]
+        self._check_database(database)
+
+    def _check_database(self, database):
+        # Staged writes must only ever be applied to the database they were made against
+        conn = self._connect()
+        conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('database', ?)", (database,))
+        staged_for = conn.execute("SELECT value FROM meta WHERE name = 'database'").fetchone()[0]
+        if staged_for != database:
+            if self.pending():
+                raise RuntimeError(f'{self.path} holds writes staged for {staged_for}; '
+                                   f'apply them or set INGEST_PATH')
+            conn.execute("UPDATE meta SET value = ? WHERE name = 'database'", (database,))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # The same durability as the main database under the default storage profile
+            conn.execute(f"PRAGMA synchronous={self.app.config['INGEST_SYNCHRONOUS']}")
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        # Threads do not survive a fork, so start the flusher in the process that serves requests
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='ingest-flusher', daemon=True).start()
+            self._pid = os.getpid()
+
+    def append(self, user_id, kind, data):
+        self.start()
+        self._connect().execute('INSERT INTO staged (user_id, kind, data, created) VALUES (?, ?, ?, ?)',
+                                (user_id, kind, json.dumps(data), time.time()))
+        # A full batch goes out at once rather than at the end of the interval
+        self._staged += 1
+        if self._staged >= self.app.config['INGEST_BATCH_SIZE']:
+            self._wake.set()
+
+    def pending(self, user_id=None):
+        if user_id is None:
+            row = self._connect().execute('SELECT 1 FROM staged LIMIT 1').fetchone()
+        else:
+            row = self._connect().execute('SELECT 1 FROM staged WHERE user_id = ? LIMIT 1', (user_id,)).fetchone()
+        return row is not None
+
+    @property
+    def _token(self):
+        # The owner of the lease; a forked worker is a different owner
+        return f'{os.getpid()}-{self._nonce}'
+
+    def _acquire_lease(self):
+        cursor = self._connect().execute(
+            "UPDATE meta SET value = ?, expires = ? WHERE name = 'lease' AND "
+            "(value IS NULL OR value = ? OR expires < ?)",
+            (self._token, time.time() + self.app.config['INGEST_LEASE'], self._token, time.time()))
+        return cursor.rowcount == 1
+
+    def _release_lease(self):
+        self._connect().execute("UPDATE meta SET value = NULL WHERE name = 'lease' AND value = ?", (self._token,))
+
+    def flush(self, user_id=None, deadline=None):
+        # Apply what is staged, batch by batch: everything, or only the writes of `user_id`.
+        # Stops at `deadline` (a time.monotonic() value) and when the lease could not be
+        # renewed. Returns the number of writes applied, 0 when another worker holds the
+        # lease. Needs an app context.
+        if not self.pending(user_id):
+            return 0
+        timeout = -1 if deadline is None else max(0, deadline - time.monotonic())
+        if not self._flush_lock.acquire(timeout=timeout):
+            return 0
+        applied = 0
+        try:
+            if not self._acquire_lease():
+                return 0
+            try:
+                conn = self._connect()
+                while True:
+                    if user_id is None:
+                        rows = conn.execute('SELECT id, user_id, kind, data, attempts FROM staged '
+                                            'ORDER BY id LIMIT ?', (self.app.config['INGEST_BATCH_SIZE'],)).fetchall()
+                    else:
+                        rows = conn.execute('SELECT id, user_id, kind, data, attempts FROM staged WHERE user_id = ? '
+                                            'ORDER BY id LIMIT ?',
+                                            (user_id, self.app.config['INGEST_BATCH_SIZE'])).fetchall()
+                    if not rows:
+                        break
+                    try:
+                        self._apply(rows)
+                    except TRANSIENT_ERRORS:
+                        db.session.rollback()
+                        raise
+                    except Exception:
+                        db.session.rollback()
+                        applied += self._apply_each(rows)
+                    else:
+                        # Ids only grow, so everything up to the last one (of the user) is in this batch
+                        if user_id is None:
+                            conn.execute('DELETE FROM staged WHERE id <= ?', (rows[-1][0],))
+                        else:
+                            conn.execute('DELETE FROM staged WHERE user_id = ? AND id <= ?', (user_id, rows[-1][0]))
+                        applied += len(rows)
+                    if deadline is not None and time.monotonic() > deadline:
+                        break
+                    # A worker that stalled past its lease has been replaced; the new holder carries on
+                    if not self._acquire_lease():
+                        self.app.logger.warning('Lost the ingest lease, leaving the remaining writes to its holder')
+                        break
+            finally:
+                self._release_lease()
+                if user_id is None:
+                    self._staged = 0
+        finally:
+            self._flush_lock.release()
+        return applied
+
+    def _apply(self, rows):
+        # A batch holds the writes of every user, whoever's request applies it
+        with unscoped():
+            apply_writes([(staged_id, user_id, kind, json.loads(data))
+                          for staged_id, user_id, kind, data, _ in rows], self.source)
+
+    def _apply_each(self, rows):
+        # One bad entry fails its whole batch, so the batch is applied again one entry at a
+        # time. An entry that keeps failing is quarantined after INGEST_MAX_ATTEMPTS tries,
+        # so it cannot hold back the writes staged after it.
+        conn = self._connect()
+        applied = 0
+        for row in rows:
+            staged_id, user_id, kind, _, attempts = row
+            try:
+                self._apply([row])
+            except TRANSIENT_ERRORS:
+                db.session.rollback()
+                raise
+            except Exception as e:
+                db.session.rollback()
+                if attempts + 1 < self.app.config['INGEST_MAX_ATTEMPTS']:
+                    conn.execute('UPDATE staged SET attempts = attempts + 1 WHERE id = ?', (staged_id,))
+                    raise
+                conn.execute('INSERT OR REPLACE INTO quarantined (id, user_id, kind, data, created, attempts, '
+                             'error, failed) SELECT id, user_id, kind, data, created, attempts + 1, ?, ? '
+                             'FROM staged WHERE id = ?', (repr(e), time.time(), staged_id))
+                self.app.logger.error(f'Quarantined staged {kind} write {staged_id} of user {user_id} '
+                                      f'after {attempts + 1} attempts: {e!r}')
+            else:
+                applied += 1
+            conn.execute('DELETE FROM staged WHERE id = ?', (staged_id,))
+        return applied
+
+    def quarantined(self):
+        return [row for row in self._connect().execute(
+            'SELECT id, user_id, kind, data, attempts, error FROM quarantined ORDER BY id')]
+
+    def sync(self, user_id):
+        # Read-your-writes: apply the user's staged writes, and only theirs, before the request
+        # reads. When another worker is applying them, wait for it up to INGEST_SYNC_TIMEOUT,
+        # which also bounds a long backlog. A failure is logged rather than raised, so the
+        # user's pages still load.
+        deadline = time.monotonic() + self.app.config['INGEST_SYNC_TIMEOUT']
+        while self.pending(user_id):
+            try:
+                self.flush(user_id, deadline)
+            except Exception:
+                self.app.logger.exception(f'Applying staged writes of user {user_id} failed')
+                return False
+            if time.monotonic() > deadline:
+                self.app.logger.warning(f'Staged writes of user {user_id} are still pending')
+                return False
+            if self.pending(user_id):
+                time.sleep(0.01)
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.app.config['INGEST_MAX_LATENCY'])
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                self.app.logger.exception('Applying staged writes failed')
+                time.sleep(self.app.config['INGEST_MAX_LATENCY'])
+
+
+def get_buffer():
+    return current_app.extensions['waweza_ingest']
+
+def submit(user_id, kind, data):
+    # Record a mood or habit log for `user_id`: staged when the buffer is on, otherwise
+    # applied and committed right away. `data` holds JSON values only, with an ISO 'day'.
+    if kind not in KINDS:
+        raise ValueError(f'Unknown write {kind}')
+    buffer = get_buffer()
+    if buffer is None:
+        apply_writes([(None, user_id, kind, data)])
+    else:
+        buffer.append(user_id, kind, data)
+
+def sync_writes(user_id):
+    # For writes that bypass the buffer: the user's staged writes are applied first, so an
+    # older staged write can never land after a direct one and overwrite it. False when they
+    # are still pending; the caller should not write then.
+    buffer = get_buffer()
+    return buffer is None or buffer.sync(user_id)
+
+def _read_your_writes():
+    buffer = get_buffer()
+    if buffer is None or request.endpoint == 'static':
+        return
+    buffer.start()
+    if request.method in ('GET', 'HEAD') and current_user.is_authenticated:
+        buffer.sync(current_user.id)
+
+@click.command('flush-writes')
+@with_appcontext
+def flush_writes_command():
+    """Apply all staged mood and habit-log writes."""
+    buffer = get_buffer()
+    count = buffer.flush() if buffer is not None else 0
+    click.echo(f'Applied {count} staged write(s).')
+    quarantined = buffer.quarantined() if buffer is not None else []
+    if quarantined:
+        click.echo(f"{len(quarantined)} write(s) that kept failing are quarantined in {buffer.path}.", err=True)
+
+def init_app(app):
+    app.config.setdefault('INGEST_BUFFER', True)
+    app.config.setdefault('INGEST_PATH', os.path.join(app.instance_path, 'ingest.db'))
+    app.config.setdefault('INGEST_BATCH_SIZE', 500)
+    app.config.setdefault('INGEST_MAX_LATENCY', 0.2)
+    app.config.setdefault('INGEST_SYNC_TIMEOUT', 5.0)
+    app.config.setdefault('INGEST_LEASE', 30)
+    app.config.setdefault('INGEST_MAX_ATTEMPTS', 3)
+    app.config.setdefault('INGEST_SYNCHRONOUS', 'NORMAL')
+
+    buffer = None
+    # An in-memory database is private to its connection, so a flusher thread would not see it
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if app.config['INGEST_BUFFER'] and not _is_memory(url):
+        os.makedirs(os.path.dirname(app.config['INGEST_PATH']), exist_ok=True)
+        buffer = IngestBuffer(app, app.config['INGEST_PATH'], url.render_as_string(hide_password=True))
+    app.extensions['waweza_ingest'] = buffer
+    app.before_request(_read_your_writes)
+    app.cli.add_command(flush_writes_command)
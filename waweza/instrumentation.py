@@ -0,0 +1,95 @@
+import os
+import re
+import time
+import logging
+from collections import Counter
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Literals and expanded IN lists vary between otherwise identical statements
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PARAM_LIST = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|:\w+)\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+slow_query_logger = logging.getLogger('waweza.sql.slow')
+
+
+def normalize_statement(statement):
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _PARAM_LIST.sub('(?...)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+def _stats():
+    # The statistics of the current request, or None outside requests (CLI, background threads)
+    if has_request_context():
+        return g.get('sql_stats')
+    return None
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    stats = _stats()
+    if stats is None:
+        return
+    stats['count'] += 1
+    stats['time'] += elapsed
+    stats['statements'][normalize_statement(statement)] += 1
+
+    elapsed_ms = elapsed * 1000
+    if elapsed_ms >= current_app.config['SQL_SLOW_QUERY_MS']:
+        slow_query_logger.warning(f'{elapsed_ms:.1f} ms {request.method} {request.path}: '
+                                  f'{_WHITESPACE.sub(" ", statement)}')
+
+def _handle_error(exception_context):
+    # after_cursor_execute does not run for failed statements
+    starts = exception_context.connection.info.get('query_start') if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+def _start_request():
+    g.sql_stats = {'count': 0, 'time': 0.0, 'statements': Counter(), 'started': time.perf_counter()}
+
+def _finish_request(response):
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+    total_ms = (time.perf_counter() - stats['started']) * 1000
+    response.headers.add('Server-Timing', f'db;dur={stats["time"] * 1000:.2f};desc="{stats["count"]} queries"')
+    response.headers.add('Server-Timing', f'app;dur={total_ms:.2f}')
+
+    # The same statement over and over in one request is usually a lazy load inside a loop
+    threshold = current_app.config['SQL_N_PLUS_ONE_THRESHOLD']
+    for statement, count in stats['statements'].items():
+        if count > threshold:
+            logging.getLogger('waweza.sql').warning(
+                f'Possible N+1 in {request.endpoint}: {count} executions of {statement[:300]}')
+    return response
+
+def init_app(app):
+    app.config.setdefault('SQL_INSTRUMENTATION', False)
+    app.config.setdefault('SQL_SLOW_QUERY_MS', 100)
+    app.config.setdefault('SQL_SLOW_QUERY_LOG', os.path.join(app.instance_path, 'slow_queries.log'))
+    app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 10)
+
+    # When disabled nothing is registered, so there is no per-statement overhead at all
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+
+    if app.config['SQL_SLOW_QUERY_LOG'] and not slow_query_logger.handlers:
+        os.makedirs(os.path.dirname(app.config['SQL_SLOW_QUERY_LOG']), exist_ok=True)
+        handler = logging.FileHandler(app.config['SQL_SLOW_QUERY_LOG'])
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_query_logger.addHandler(handler)
+
+    # Listening on the Engine class also covers engines created after a config change
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import queue
+import atexit
+import smtplib
+import threading
+from datetime import datetime
+
+
+class MailQueue:
+    # Bounded outbound mail queue drained by background threads. Each thread opens one SMTP
+    # connection per batch of queued messages, so request handlers never wait on SMTP.
+
+    def __init__(self, app=None, mail=None):
+        self.mail = mail
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        # The (lock, batch) each worker thread is sending. A message leaves the batch once it
+        # is delivered or dead-lettered, under the lock, so shutdown sees exactly the rest.
+        self._in_flight = {}
+        self._exit_registered = False
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail=None):
+        self.app = app
+        self.mail = mail
+        self._pid = None
+        app.config.setdefault('MAIL_QUEUE_SIZE', 1000)
+        app.config.setdefault('MAIL_QUEUE_WORKERS', 2)
+        app.config.setdefault('MAIL_QUEUE_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_QUEUE_RETRIES', 3)
+        app.config.setdefault('MAIL_QUEUE_BACKOFF', 2.0)
+        app.config.setdefault('MAIL_DEAD_LETTER_PATH', os.path.join(app.instance_path, 'mail_dead_letter.jsonl'))
+        app.config.setdefault('MAIL_QUEUE_SHUTDOWN_TIMEOUT', 10.0)
+        self._queue = queue.Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+        app.extensions['mail_queue'] = self
+        if not self._exit_registered:
+            atexit.register(self.shutdown)
+            self._exit_registered = True
+
+    def get_mail(self):
+        # Flask-Mail is set up when the first message is queued rather than at startup
+        if self.mail is None:
+            from flask_mail import Mail
+            self.mail = Mail(self.app)
+        return self.mail
+
+    def enqueue(self, message):
+        self.get_mail()
+        self._start_workers()
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            # Better a slow request than a lost verification email
+            self.app.logger.warning('Mail queue is full, sending inline')
+            self._send_batch([message])
+
+    def _start_workers(self):
+        # Threads do not survive a fork, so start them in the process that actually sends,
+        # which also keeps gunicorn --preload working
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for _ in range(self.app.config['MAIL_QUEUE_WORKERS']):
+                thread = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _run(self):
+        batch_size = self.app.config['MAIL_QUEUE_BATCH_SIZE']
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            size = len(batch)
+            lock = threading.Lock()
+            self._in_flight[threading.get_ident()] = (lock, batch)
+            try:
+                self._send_batch(batch, lock)
+            except Exception:
+                self.app.logger.exception('Mail queue worker failed')
+            finally:
+                self._in_flight.pop(threading.get_ident(), None)
+                for _ in range(size):
+                    self._queue.task_done()
+
+    def _send_batch(self, pending, lock=None):
+        # Sends the messages of `pending` in order over one SMTP connection, opening a new
+        # one after a failure, and removes each message once it is delivered or dead-lettered
+        lock = lock or threading.Lock()
+        retries = self.app.config['MAIL_QUEUE_RETRIES']
+        backoff = self.app.config['MAIL_QUEUE_BACKOFF']
+        attempt = 0
+        with self.app.app_context():
+            while pending:
+                try:
+                    with self.get_mail().connect() as connection:
+                        while True:
+                            with lock:
+                                if not pending:
+                                    break
+                                connection.send(pending[0])
+                                pending.pop(0)
+                except (smtplib.SMTPException, OSError) as e:
+                    attempt += 1
+                    if attempt > retries:
+                        # Give up on the message that keeps failing and carry on with the rest
+                        with lock:
+                            if pending:
+                                self._dead_letter(pending.pop(0), e)
+                        attempt = 0
+                        continue
+                    self.app.logger.warning(f'Sending mail failed ({e}), retry {attempt} of {retries}')
+                    time.sleep(backoff ** attempt)
+
+    def _dead_letter(self, message, error):
+        record = {
+            'failed_at': datetime.utcnow().isoformat(),
+            'error': str(error),
+            'subject': message.subject,
+            'sender': message.sender,
+            'recipients': message.recipients,
+            'body': message.body
+        }
+        path = self.app.config['MAIL_DEAD_LETTER_PATH']
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock, open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        self.app.logger.error(f'Mail to {message.recipients} moved to the dead-letter file: {error}')
+
+    def shutdown(self, timeout=None):
+        # Called at exit: the workers get up to MAIL_QUEUE_SHUTDOWN_TIMEOUT to send what is
+        # queued and in flight, and whatever is left is recorded rather than silently dropped
+        if timeout is None:
+            timeout = self.app.config['MAIL_QUEUE_SHUTDOWN_TIMEOUT']
+        if self._pid == os.getpid():
+            deadline = time.monotonic() + timeout
+            with self._queue.all_tasks_done:
+                while self._queue.unfinished_tasks and time.monotonic() < deadline:
+                    self._queue.all_tasks_done.wait(deadline - time.monotonic())
+
+        while True:
+            try:
+                message = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._dead_letter(message, 'process exited before the message was sent')
+        # Taken from the workers, so a later shutdown or retry does not record them twice. A
+        # message still being handed to the server when the wait ends may or may not arrive,
+        # and is recorded as such rather than as unsent.
+        for ident in list(self._in_flight):
+            lock, batch = self._in_flight.pop(ident, (None, None))
+            if batch is None:
+                continue
+            locked = lock.acquire(timeout=1.0)
+            unsent = list(batch)
+            del batch[:]
+            if locked:
+                lock.release()
+            for n, message in enumerate(unsent):
+                if n == 0 and not locked:
+                    self._dead_letter(message, 'process exited while the message was being sent; it may have arrived')
+                else:
+                    self._dead_letter(message, 'process exited before the message was sent')
+
+    def join(self):
+        # Block until everything queued so far has been handled; used by CLI commands and tests
+        self._queue.join()
@@ -1,15 +1,11 @@
 from datetime import datetime, timedelta
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from sqlalchemy import Enum
 from enum import Enum as pyEnum
-from waweza import db, login_manager, app
+from flask import current_app
+from waweza import db
 from flask_login import UserMixin
 
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
@@ -23,19 +19,34 @@ class User(db.Model, UserMixin):
     moods = db.relationship('Mood', backref='user', lazy=True)
     verified = db.Column(db.Boolean, default=False)
 
+    @staticmethod
+    def _serializer(expires_sec=1800, salt='itsdangerous'):
+        # Imported here so that only the routes sending or checking tokens pay for it
+        from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+        return Serializer(current_app.config['SECRET_KEY'], expires_sec, salt=salt)
+
     def get_verification_token(self, expires_sec=1800):
-        s = Serializer(app.config['SECRET_KEY'], expires_sec)
+        s = User._serializer(expires_sec)
         return s.dumps({'user_id': self.id}).decode('utf-8')
 
     @staticmethod
-    def verify_token(token):
-        s = Serializer(app.config['SECRET_KEY'])
+    def verify_token(token, salt='itsdangerous'):
+        s = User._serializer(salt=salt)
         try:
             user_id = s.loads(token)['user_id']
         except:
             return None
         return User.query.get(user_id)
 
+    # Reset tokens are signed with their own salt, so a verification link cannot reset a password
+    def get_reset_token(self, expires_sec=1800):
+        s = User._serializer(expires_sec, salt='password-reset')
+        return s.dumps({'user_id': self.id}).decode('utf-8')
+
+    @staticmethod
+    def verify_reset_token(token):
+        return User.verify_token(token, salt='password-reset')
+
     def __repr__(self):
         return f"User('{self.username}', '{self.email}', '{self.image_file}')"
     
@@ -52,6 +63,10 @@ class StatusType(pyEnum):
         return self.value
     
 class Goal(db.Model):
+    __table_args__ = (
+        db.Index('ix_goal_user_id_status', 'user_id', 'status'),
+        db.Index('ix_goal_user_id_created_at', 'user_id', 'created_at')
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(100), nullable=False)
@@ -69,7 +84,7 @@ class Goal(db.Model):
 
 class Habit(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     goal_id = db.Column(db.Integer, db.ForeignKey('goal.id'), nullable=False)
     name = db.Column(db.String(20), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -86,9 +101,13 @@ class Habit(db.Model):
         return f"Habit('{self.name}')"
     
 class HabitLog(db.Model):
+    __table_args__ = (db.UniqueConstraint('habit_id', 'day', name='uq_habit_log_habit_id_day'),)
     id = db.Column(db.Integer, primary_key=True)
     habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), nullable=False)
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Calendar day of `date`, kept in sync on write so per-day lookups can use an index.
+    # There is at most one log per habit and day; writes go through upsert_habit_logs.
+    day = db.Column(db.Date, nullable=False)
     completed = db.Column(db.Boolean, nullable=False, default=False)
     notes = db.Column(db.Text, nullable=True)
 
@@ -103,11 +122,52 @@ class MoodType(pyEnum):
     ANXIOUS = 'anxious'
 
 class Mood(db.Model):
+    __table_args__ = (db.Index('ix_mood_user_id_day', 'user_id', 'day'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     mood_type = db.Column(Enum(MoodType), nullable=False)
     notes = db.Column(db.Text, nullable=True)
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    day = db.Column(db.Date, nullable=False)
+
+    def __repr__(self):
+        return f"Mood('{self.mood_type.value}', '{self.date}')"
+
+@db.event.listens_for(HabitLog, 'before_insert')
+@db.event.listens_for(HabitLog, 'before_update')
+@db.event.listens_for(Mood, 'before_insert')
+@db.event.listens_for(Mood, 'before_update')
+def set_day(mapper, connection, target):
+    if target.date is None:
+        target.date = datetime.utcnow()
+    elif not isinstance(target.date, datetime):
+        # Forms hand us plain dates
+        target.date = datetime.combine(target.date, datetime.min.time())
+    target.day = target.date.date()
+
+class HabitDailyRollup(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"HabitDailyRollup('{self.user_id}', '{self.day}', '{self.completed}/{self.total}')"
+
+class MoodDailyRollup(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    mood_type = db.Column(Enum(MoodType), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"MoodDailyRollup('{self.user_id}', '{self.day}', '{self.mood_type.value}', '{self.count}')"
+class IngestCheckpoint(db.Model):
+    # Last staged write applied per ingest staging file and user ('<source>:<user_id>'),
+    # committed with the writes themselves so a batch replayed after a crash is not applied
+    # twice. Per user, because one user's writes can be applied ahead of the others'.
+    source = db.Column(db.String(32), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
 
     def __repr__(self):
-        return f"Mood('{self.mood_type.value}', '{self.date}')"
\ No newline at end of file
+        return f"IngestCheckpoint('{self.source}', '{self.last_id}')"
@@ -0,0 +1,51 @@
+import json
+import base64
+from collections import namedtuple
+from datetime import datetime, date
+from flask import current_app, request, abort
+from sqlalchemy import or_, and_
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(position, item_id):
+    raw = json.dumps([position.isoformat(), item_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position, item_id = json.loads(raw)
+        # Day columns hold plain dates, which compare differently from datetimes in SQLite
+        position = date.fromisoformat(position) if len(position) == 10 else datetime.fromisoformat(position)
+        return position, int(item_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def get_page_args():
+    # Cursor and page size from the query string, with the page size capped by config
+    per_page = request.args.get('per_page', current_app.config['PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['MAX_PER_PAGE']))
+    return request.args.get('cursor'), per_page
+
+def keyset_paginate(query, order_column, id_column, cursor=None, per_page=20):
+    # Newest first by (order_column, id); the cursor holds the last row of the previous page,
+    # so every page is an index range scan no matter how deep it is. That needs an index on
+    # (filter column, order_column); SQLite appends the id to every index entry.
+    if cursor:
+        try:
+            position, item_id = decode_cursor(cursor)
+        except ValueError:
+            abort(400)
+        query = query.filter(or_(
+            order_column < position,
+            and_(order_column == position, id_column < item_id)
+        ))
+
+    items = query.order_by(order_column.desc(), id_column.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, order_column.key), getattr(last, id_column.key))
+    return Page(items, next_cursor)
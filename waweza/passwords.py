@@ -0,0 +1,107 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    # Raised when no hashing slot frees up within PASSWORD_HASH_TIMEOUT
+    pass
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def check_password(pw_hash, password):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+def hash_rounds(pw_hash):
+    # The cost factor stored in a '$2b$12$...' hash
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    # bcrypt in a small process pool. At most PASSWORD_HASH_CONCURRENCY hashes are in flight
+    # per web worker; callers wait up to PASSWORD_HASH_TIMEOUT for a slot and then get
+    # PasswordHasherBusy, so a login burst cannot take all the CPU from other requests.
+
+    def __init__(self, app=None):
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 1)
+        app.config.setdefault('PASSWORD_HASH_CONCURRENCY', 2)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5.0)
+        self._shutdown()
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_CONCURRENCY'])
+        app.extensions['password_hasher'] = self
+
+    @property
+    def rounds(self):
+        return self.app.config['BCRYPT_LOG_ROUNDS']
+
+    def _get_pool(self):
+        # Like the mail queue threads, the pool is created in the process that uses it,
+        # so gunicorn --preload does not share one pool between forked workers
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(self.app.config['PASSWORD_HASH_WORKERS'],
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _shutdown(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        self._pid = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.app.config['PASSWORD_HASH_TIMEOUT']):
+            raise PasswordHasherBusy()
+        try:
+            # PASSWORD_HASH_WORKERS = 0 hashes on the request thread, still within the cap
+            if not self.app.config['PASSWORD_HASH_WORKERS']:
+                return fn(*args)
+            try:
+                return self._get_pool().submit(fn, *args).result()
+            except BrokenProcessPool:
+                # A worker died (OOM killer, signal); start a fresh pool and try once more
+                with self._lock:
+                    self._shutdown()
+                try:
+                    return self._get_pool().submit(fn, *args).result()
+                except BrokenProcessPool:
+                    # Workers cannot start at all; hash here rather than fail the request
+                    self.app.logger.error('Password hashing pool is broken, hashing on the request thread')
+                    with self._lock:
+                        self._shutdown()
+                    return fn(*args)
+        finally:
+            self._slots.release()
+
+    def generate_password_hash(self, password):
+        return self._run(hash_password, password, self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        return self._run(check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        return hash_rounds(pw_hash) != self.rounds
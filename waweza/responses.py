@@ -0,0 +1,54 @@
+import gzip
+import orjson
+from flask import request, current_app
+from waweza.cache import cached, etag_for
+
+# orjson handles enums, dates and NumPy values itself; streak and chart dicts use int keys
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps(data):
+    return orjson.dumps(data, option=ORJSON_OPTIONS)
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return _brotli().compress(body, quality=current_app.config['JSON_BROTLI_QUALITY'])
+    return gzip.compress(body, compresslevel=current_app.config['JSON_GZIP_LEVEL'], mtime=0)
+
+def negotiate_encoding():
+    encodings = ['br', 'gzip'] if _brotli() is not None else ['gzip']
+    return request.accept_encodings.best_match(encodings)
+
+def cached_json(key, compute):
+    # A JSON response for the cache entry `key`, with the ETag checked before anything is
+    # computed. The serialized body and each compressed variant are cached next to the
+    # payload, so a repeat request neither serializes nor compresses.
+    etag = etag_for(key)
+    encoding = negotiate_encoding()
+    # Each encoding is its own representation; small bodies are sent as they are
+    tags = [etag, f'{etag}-{encoding}'] if encoding else [etag]
+    headers = {'Cache-Control': 'private, no-cache', 'Vary': 'Accept-Encoding'}
+    for tag in tags:
+        if request.if_none_match.contains(tag):
+            return '', 304, dict(headers, ETag=f'"{tag}"')
+
+    # Counted once, as a hit when the serialized body was cached
+    body = cached(f'{key}:json', lambda: dumps(cached(key, compute, count=False)))
+    if encoding and len(body) >= current_app.config['JSON_COMPRESS_MIN_SIZE']:
+        body = cached(f'{key}:{encoding}', lambda: _compress(body, encoding), count=False)
+        headers['Content-Encoding'] = encoding
+        etag = tags[1]
+    headers['ETag'] = f'"{etag}"'
+    return current_app.response_class(body, mimetype='application/json', headers=headers)
+
+def init_app(app):
+    app.config.setdefault('JSON_COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('JSON_GZIP_LEVEL', 6)
+    app.config.setdefault('JSON_BROTLI_QUALITY', 5)
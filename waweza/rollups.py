@@ -0,0 +1,118 @@
+from datetime import datetime, date
+from collections import Counter
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, case
+from waweza import db
+from waweza.models import User, Habit, HabitLog, Mood, HabitDailyRollup, MoodDailyRollup
+
+
+def as_day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+def habit_log_days(habit_ids):
+    # Distinct days touched by the given habits, used before deleting them
+    if not habit_ids:
+        return set()
+    rows = db.session.query(HabitLog.day).filter(
+        HabitLog.habit_id.in_(habit_ids)
+    ).distinct().all()
+    return {as_day(day) for day, in rows}
+
+def _rebuild_habit_rollups(user_id, days=None):
+    rollups = HabitDailyRollup.query.filter(HabitDailyRollup.user_id == user_id)
+    logs = db.session.query(
+        HabitLog.day,
+        func.sum(case((HabitLog.completed == True, 1), else_=0)),
+        func.count(HabitLog.id)
+    ).join(Habit).filter(Habit.user_id == user_id)
+    if days is not None:
+        rollups = rollups.filter(HabitDailyRollup.day.in_(days))
+        logs = logs.filter(HabitLog.day.in_(days))
+
+    rollups.delete(synchronize_session=False)
+    db.session.add_all([
+        HabitDailyRollup(user_id=user_id, day=as_day(day), completed=completed, total=total)
+        for day, completed, total in logs.group_by(HabitLog.day).all()
+    ])
+
+def _rebuild_mood_rollups(user_id, days=None):
+    rollups = MoodDailyRollup.query.filter(MoodDailyRollup.user_id == user_id)
+    moods = db.session.query(
+        Mood.day, Mood.mood_type, func.count(Mood.id)
+    ).filter(Mood.user_id == user_id)
+    if days is not None:
+        rollups = rollups.filter(MoodDailyRollup.day.in_(days))
+        moods = moods.filter(Mood.day.in_(days))
+
+    rollups.delete(synchronize_session=False)
+    db.session.add_all([
+        MoodDailyRollup(user_id=user_id, day=as_day(day), mood_type=mood_type, count=count)
+        for day, mood_type, count in moods.group_by(Mood.day, Mood.mood_type).all()
+    ])
+
+def refresh_habit_rollups(user_id, days):
+    # Recompute the habit rollup rows of a user for the given days from the raw logs.
+    # The caller is responsible for committing the session.
+    days = {as_day(day) for day in days if day is not None}
+    if days:
+        db.session.flush()
+        _rebuild_habit_rollups(user_id, days)
+
+def refresh_mood_rollups(user_id, days):
+    # Recompute the mood rollup rows of a user for the given days from the raw moods.
+    # The caller is responsible for committing the session.
+    days = {as_day(day) for day in days if day is not None}
+    if days:
+        db.session.flush()
+        _rebuild_mood_rollups(user_id, days)
+
+def get_rollup_totals(user_id, start, end):
+    # Aggregate a user's rollups over [start, end]; touches one row per day at most
+    start, end = as_day(start), as_day(end)
+    completed, total = db.session.query(
+        func.coalesce(func.sum(HabitDailyRollup.completed), 0),
+        func.coalesce(func.sum(HabitDailyRollup.total), 0)
+    ).filter(
+        HabitDailyRollup.user_id == user_id,
+        HabitDailyRollup.day >= start,
+        HabitDailyRollup.day <= end
+    ).one()
+
+    mood_rows = db.session.query(
+        MoodDailyRollup.mood_type, func.sum(MoodDailyRollup.count)
+    ).filter(
+        MoodDailyRollup.user_id == user_id,
+        MoodDailyRollup.day >= start,
+        MoodDailyRollup.day <= end
+    ).group_by(MoodDailyRollup.mood_type).all()
+
+    return {
+        'completed': completed,
+        'total': total,
+        'moods': Counter({mood_type.value: count for mood_type, count in mood_rows})
+    }
+
+def rebuild_rollups(user_id=None):
+    # Rebuild the rollup tables from the full history, one user at a time
+    user_ids = [user_id] if user_id else [uid for uid, in db.session.query(User.id).all()]
+    for uid in user_ids:
+        _rebuild_habit_rollups(uid)
+        _rebuild_mood_rollups(uid)
+        db.session.commit()
+    return len(user_ids)
+
+@click.command('rebuild-rollups')
+@click.option('--user-id', type=int, default=None, help='Only rebuild the rollups of this user.')
+@with_appcontext
+def rebuild_rollups_command(user_id):
+    """Rebuild the daily habit and mood rollups from history."""
+    count = rebuild_rollups(user_id)
+    click.echo(f'Rebuilt rollups for {count} user(s).')
+
+def init_app(app):
+    app.cli.add_command(rebuild_rollups_command)
@@ -1,191 +1,201 @@
-from flask import Blueprint, render_template, abort, url_for, flash, redirect, jsonify, request
-from waweza import app, db, bcrypt, mail
-from waweza.forms import RegistrationForm, UpdateAccountForm, LoginForm, GoalForm, HabitForm, HabitLogForm, MoodForm, HabitStatusForm, RequestResetForm, ResetPasswordForm, ResendVerificationForm
+from flask import Blueprint, render_template, abort, url_for, flash, redirect, jsonify, request, Response, stream_with_context
+from waweza import db, password_hasher, mail_queue
+from waweza.passwords import PasswordHasherBusy
+from waweza.forms import RegistrationForm, UpdateAccountForm, LoginForm, GoalForm, HabitForm, HabitLogForm, MoodForm, HabitStatusForm, RequestResetForm, ResetPasswordForm, ResendVerificationForm, ImportForm
 from waweza.models import User, GoalType, StatusType, Goal, Habit, HabitLog, MoodType, Mood
-from waweza.helpers import get_analytics_data, calculate_habit_streak
+from waweza.helpers import get_analytics_data, get_window_range, get_home_summary, get_habit_streaks, get_goal_choices, get_habit_listing, get_mood_chart, get_mood_series, parse_mood_series_args, habit_log_row, upsert_habit_logs, parse_batch_logs, log_habits
+from waweza.pagination import keyset_paginate, get_page_args
+from waweza.analytics import get_correlations
+from waweza.storage import use_reader
+from waweza.identity import invalidate_user
+from waweza.cache import cached, cache_key, bump_data_version, cache_stats
+from waweza.responses import cached_json
+from waweza.ingest import submit as submit_write, sync_writes
+from flask_wtf.csrf import validate_csrf
+from wtforms.validators import ValidationError
 from flask_login import login_user, current_user, logout_user, login_required
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.exc import SQLAlchemyError
 from flask import session, current_app
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
 from collections import Counter
-from flask_mail import Message
 from waweza.utils import save_picture
+from waweza.rollups import refresh_habit_rollups, refresh_mood_rollups, habit_log_days
+from waweza.transfer import export_ndjson, export_csv, import_ndjson, EXPORT_FIELDS
+import io
 
 
+main_bp = Blueprint('main', __name__)
 goal_bp = Blueprint('goal', __name__)
 habit_bp = Blueprint('habit', __name__)
 mood_bp = Blueprint('mood', __name__)
 analytics_bp = Blueprint('analytics', __name__)
+transfer_bp = Blueprint('transfer', __name__)
 
 
+WRITES_PENDING = 'Your earlier changes are still being saved. Please try again in a moment.'
+
+
+def password_hasher_busy(template, **context):
+    # Every password hashing slot stayed taken; ask the client to come back shortly
+    flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'warning')
+    return render_template(template, **context), 503, {'Retry-After': '5'}
+
 def send_verification_email(user):
+    from flask_mail import Message
     token = user.get_verification_token()
     msg = Message('Verify Your Email',
                   sender='noreply@yourdomain.com',
                   recipients=[user.email])
     msg.body = f'''To verify your email, visit the following link:
-{url_for('verify_email', token=token, _external=True)}
+{url_for('main.verify_email', token=token, _external=True)}
 
 If you did not make this request then simply ignore this email.
 '''
-    mail.send(msg)
+    mail_queue.enqueue(msg)
 
 def send_reset_email(user):
+    from flask_mail import Message
     token = user.get_reset_token()
     msg = Message('Password Reset Request',
                   sender='noreply@yourdomain.com',
                   recipients=[user.email])
     msg.body = f'''To reset your password, visit the following link:
-{url_for('reset_token', token=token, _external=True)}
+{url_for('main.reset_token', token=token, _external=True)}
 
 If you did not make this request then simply ignore this email and no changes will be made.
 '''
-    mail.send(msg)
+    mail_queue.enqueue(msg)
 
-@app.route("/")
+@main_bp.route("/")
 def landing():
     return render_template('landing.html', title='Welcome to Waweza')
 
 
-@app.route("/home")
+@main_bp.route("/home")
+@use_reader
 @login_required
 def home():
     current_date = datetime.utcnow()
-    
-    # Fetch data for summaries
-    goals_count = Goal.query.filter_by(user_id=current_user.id, status='in_progress').count()
-    completed_goals_count = Goal.query.filter_by(user_id=current_user.id, status='completed').count()
-    habits_count = Habit.query.filter_by(user_id=current_user.id).count()
-    habits_completed_today = HabitLog.query.filter(
-        HabitLog.habit.has(user_id=current_user.id),
-        HabitLog.date == current_date.date(),
-        HabitLog.completed == True
-    ).count()
-    
-    # Fetch mood data for the last 7 days
-    seven_days_ago = current_date - timedelta(days=7)
-    moods = Mood.query.filter(
-        Mood.user_id == current_user.id,
-        Mood.date >= seven_days_ago
-    ).order_by(Mood.date).all()
-    
-    mood_to_number = {
-    'HAPPY': 0,
-    'FRUSTRATED': 1,
-    'NEUTRAL': 2,
-    'SAD': 3,
-    'ANXIOUS': 4 
-    }
-
-    mood_dates = [mood.date.strftime('%Y-%m-%d') for mood in moods]
-    mood_values = [mood_to_number[mood.mood_type.name] for mood in moods]
-    mood_average = sum(mood_values) / len(mood_values) if mood_values else 0
-    
-    # Calculate goal completion rate and habit streak
-    total_goals = Goal.query.filter_by(user_id=current_user.id).count()
-    goal_completion_rate = (completed_goals_count / total_goals * 100) if total_goals > 0 else 0
-    
-    habit_streak = calculate_habit_streak(current_user.id)
-    
-    return render_template('home.html',
-                           current_date=current_date,
-                           goals_count=goals_count,
-                           completed_goals_count=completed_goals_count,
-                           habits_count=habits_count,
-                           habits_completed_today=habits_completed_today,
-                           mood_dates=mood_dates,
-                           mood_values=mood_values,
-                           mood_average=round(mood_average, 1),
-                           goal_completion_rate=round(goal_completion_rate, 1),
-                           habit_streak=habit_streak)
-
-@app.route("/about")
+    key = cache_key('home', current_user.id, current_date.date())
+    summary = cached(key, lambda: get_home_summary(current_user.id, current_date.date()))
+    return render_template('home.html', current_date=current_date, **summary)
+
+@main_bp.route("/home/summary.json")
+@use_reader
+@login_required
+def home_summary():
+    # Shares the cache entry of /home, so polling costs nothing until the user writes
+    today = datetime.utcnow().date()
+    key = cache_key('home', current_user.id, today)
+    return cached_json(key, lambda: get_home_summary(current_user.id, today))
+
+@main_bp.route("/about")
 def about():
     return render_template('about.html', title='About')
 
-@app.route("/register", methods=['GET', 'POST'])
+@main_bp.route("/register", methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        db.session.commit()
+        try:
+            hashed_password = password_hasher.generate_password_hash(form.password.data)
+        except PasswordHasherBusy:
+            return password_hasher_busy('register.html', title='Register', form=form)
         user = User(username=form.username.data, email=form.email.data, password=hashed_password)
         user.verified = False
         db.session.add(user)
         db.session.commit()
         send_verification_email(user)
         flash('Your account has been created! Please check your email to verify your account.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html', title='Register', form=form)
 
-@app.route("/verify_email/<token>")
+@main_bp.route("/verify_email/<token>")
 def verify_email(token):
     user = User.verify_token(token)
     if user is None:
         flash('That is an invalid or expired token', 'warning')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     user.verified = True
     db.session.commit()
+    invalidate_user(user.id)
     flash('Your email has been verified! You can now login.', 'success')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route("/login", methods=['GET', 'POST'])
+@main_bp.route("/login", methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        pw_hash = user.password if user else None
+        # End the read transaction so bcrypt does not hold a pooled connection; SQLite only has one
+        db.session.commit()
+        try:
+            valid = pw_hash is not None and password_hasher.check_password_hash(pw_hash, form.password.data)
+            # Hashes made with an older cost factor are upgraded while the password is at hand
+            if valid and password_hasher.needs_rehash(pw_hash):
+                user.password = password_hasher.generate_password_hash(form.password.data)
+                db.session.commit()
+        except PasswordHasherBusy:
+            return password_hasher_busy('login.html', title='Login', form=form)
+        if valid:
             if user.verified:
                 login_user(user, remember=form.remember.data)
-                return redirect(url_for('home'))
+                return redirect(url_for('main.home'))
             else:
                 flash('Please verify your email before logging in.', 'warning')
         else:
             flash('Login Unsuccessful. Please check email and password', 'danger')
     return render_template('login.html', title='Login', form=form)
 
-@app.route("/logout")
+@main_bp.route("/logout")
 def logout():
     logout_user()
-    return redirect(url_for('landing'))
+    return redirect(url_for('main.landing'))
 
-@app.route("/reset_password", methods=['GET', 'POST'])
+@main_bp.route("/reset_password", methods=['GET', 'POST'])
 def reset_request():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = RequestResetForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         send_reset_email(user)
         flash('An email has been sent with instructions to reset your password.', 'info')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_request.html', title='Reset Password', form=form)
 
-@app.route("/reset_password/<token>", methods=['GET', 'POST'])
+@main_bp.route("/reset_password/<token>", methods=['GET', 'POST'])
 def reset_token(token):
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     user = User.verify_reset_token(token)
     if user is None:
         flash('That is an invalid or expired token', 'warning')
-        return redirect(url_for('reset_request'))
+        return redirect(url_for('main.reset_request'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        db.session.commit()
+        try:
+            hashed_password = password_hasher.generate_password_hash(form.password.data)
+        except PasswordHasherBusy:
+            return password_hasher_busy('reset_token.html', title='Reset Password', form=form)
         user.password = hashed_password
         db.session.commit()
         flash('Your password has been updated! You are now able to log in', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_token.html', title='Reset Password', form=form)
 
-@app.route("/resend_verification", methods=['GET', 'POST'])
+@main_bp.route("/resend_verification", methods=['GET', 'POST'])
 def resend_verification():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = ResendVerificationForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
@@ -194,30 +204,35 @@ def resend_verification():
             flash('A new verification email has been sent.', 'info')
         else:
             flash('Invalid email or account already verified.', 'warning')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('resend_verification.html', title='Resend Verification Email', form=form)
 
-@app.route("/account", methods=['GET', 'POST'])
+@main_bp.route("/account", methods=['GET', 'POST'])
 @login_required
 def account():
     form = UpdateAccountForm()
     if form.validate_on_submit():
+        # current_user is a cached snapshot, so the changes go to the User row
+        user = User.query.get_or_404(current_user.id)
         if form.picture.data:
-            picture_file = save_picture(form.picture.data)
-            current_user.image_file = picture_file
-        current_user.username = form.username.data
-        current_user.email = form.email.data
+            try:
+                user.image_file = save_picture(form.picture.data)
+            except ValueError as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('main.account'))
+        user.username = form.username.data
+        user.email = form.email.data
         db.session.commit()
+        invalidate_user(user.id)
         flash('Your account has been updated!', 'success')
-        return redirect(url_for('account'))
+        return redirect(url_for('main.account'))
     elif request.method == 'GET':
         form.username.data = current_user.username
         form.email.data = current_user.email
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    return render_template('account.html', title='Account',
-                           image_file=image_file, form=form)
+    return render_template('account.html', title='Account', form=form)
 
 @goal_bp.route("/goals", methods=['GET', 'POST'])
+@use_reader
 @login_required
 def goals():
     form = GoalForm()
@@ -234,6 +249,7 @@ def goals():
         )
         db.session.add(new_goal)
         db.session.commit()
+        bump_data_version(current_user.id)
         flash('Goal created successfully!', 'success')
         return redirect(url_for('goal.goals'))
     
@@ -241,15 +257,15 @@ def goals():
         print("Form validation failed")
         print(form.errors)
     
-    goals = Goal.query.all()
-    return render_template('goals.html', form=form, goals=goals)
+    cursor, per_page = get_page_args()
+    page = keyset_paginate(Goal.query.filter_by(user_id=current_user.id),
+                           Goal.created_at, Goal.id, cursor, per_page)
+    return render_template('goals.html', form=form, goals=page.items, page=page)
     
 @goal_bp.route("/goal/<int:goal_id>/edit", methods=['GET', 'POST'])
 @login_required
 def edit_goal(goal_id):
     goal = Goal.query.get_or_404(goal_id)
-    if goal.user_id != current_user.id:
-        abort(403)
     form = GoalForm(obj=goal)
     if form.validate_on_submit():
         print("Form validation successful!")
@@ -260,6 +276,7 @@ def edit_goal(goal_id):
         goal.end_date = form.end_date.data
         goal.status = StatusType(form.status.data)
         db.session.commit()
+        bump_data_version(current_user.id)
         flash('Goal updated successfully', 'success')
         return redirect(url_for('goal.goals'))
     
@@ -273,11 +290,12 @@ def edit_goal(goal_id):
 @login_required
 def delete_goal(goal_id):
     goal = Goal.query.get_or_404(goal_id)
-    if goal.user_id != current_user.id:
-        abort(403)
     try:
+        days = habit_log_days([habit.id for habit in goal.habits])
         db.session.delete(goal)
+        refresh_habit_rollups(goal.user_id, days)
         db.session.commit()
+        bump_data_version(current_user.id)
         flash('Goal deleted successfully', 'success')
     except SQLAlchemyError as e:
         db.session.rollback()
@@ -285,10 +303,11 @@ def delete_goal(goal_id):
     return redirect(url_for('goal.goals'))
 
 @habit_bp.route("/habits", methods=['GET', 'POST'])
+@use_reader
 @login_required
 def habits():
     form = HabitForm()
-    form.goal.choices = [(goal.id, goal.title) for goal in Goal.query.all()]
+    form.goal.choices = get_goal_choices(current_user.id)
 
     if form.validate_on_submit():
         print("Form validation was successful")
@@ -298,6 +317,7 @@ def habits():
             user_id=current_user.id)
         db.session.add(new_habit)
         db.session.commit()
+        bump_data_version(current_user.id)
         flash('Habit created successfully', 'success')
         return redirect(url_for('habit.habits'))
     
@@ -305,27 +325,28 @@ def habits():
         print("Form validation failed")
         print(form.errors)
     
-    habits = Habit.query.all()
-    return render_template('habits.html', form=form, habits=habits)
+    # The checkboxes show today's status, so the cached list changes with the day too
+    today = datetime.utcnow().date()
+    habits = get_habit_listing(current_user.id, today)
+    return render_template('habits.html', form=form, habits=habits, today=today)
 
 @habit_bp.route("/habit/<int:habit_id>/log", methods=['GET', 'POST'])
+@use_reader
 @login_required
 def log_habit(habit_id):
     form = HabitLogForm()
     habit = Habit.query.get_or_404(habit_id)
-    if habit.user_id != current_user.id:
-        abort(403)
 
     if form.validate_on_submit():
         print("Form validated sucessfully!")
-        new_log = HabitLog(
-            habit_id=habit_id,
-            date=form.date.data,
-            completed=form.completed.data,
-            notes=form.notes.data)
+        if not sync_writes(current_user.id):
+            flash(WRITES_PENDING, 'warning')
+            return redirect(url_for('habit.habits'))
         try:
-            db.session.add(new_log)
+            upsert_habit_logs([habit_log_row(habit_id, form.date.data, form.completed.data, form.notes.data)])
+            refresh_habit_rollups(current_user.id, [form.date.data])
             db.session.commit()
+            bump_data_version(current_user.id)
             flash('Habit log updated successfully', 'sucess')
         except Exception as e:
             db.session.rollback()
@@ -337,27 +358,31 @@ def log_habit(habit_id):
         print("Form validation failed")
         print(form.errors)
     
-    logs = HabitLog.query.filter_by(habit_id=habit_id).order_by(HabitLog.date.desc()).all()
-    return render_template('log_habit.html', form=form, habit=habit, logs=logs)
+    cursor, per_page = get_page_args()
+    page = keyset_paginate(HabitLog.query.filter_by(habit_id=habit_id),
+                           HabitLog.day, HabitLog.id, cursor, per_page)
+    return render_template('log_habit.html', form=form, habit=habit, logs=page.items, page=page)
 
 @habit_bp.route("/habit/<int:habit_id>/history")
+@use_reader
 @login_required
 def habits_history(habit_id):
     habit = Habit.query.get_or_404(habit_id)
-    if habit.user_id != current_user.id:
-        abort(403)
-    habit_history = HabitLog.query.filter_by(habit_id=habit_id).order_by(HabitLog.date.desc()).all()
-    return render_template('habits_history.html', habit=habit, habit_history=habit_history)
+    cursor, per_page = get_page_args()
+    page = keyset_paginate(HabitLog.query.filter_by(habit_id=habit_id),
+                           HabitLog.day, HabitLog.id, cursor, per_page)
+    return render_template('habits_history.html', habit=habit, habit_history=page.items, page=page)
 
 @habit_bp.route("/habit/<int:habit_id>/delete", methods=['POST'])
 @login_required
 def delete_habit(habit_id):
     habit = Habit.query.get_or_404(habit_id)
-    if habit.user_id != current_user.id:
-        abort(403)
     try:
+        days = habit_log_days([habit.id])
         db.session.delete(habit)
+        refresh_habit_rollups(habit.user_id, days)
         db.session.commit()
+        bump_data_version(current_user.id)
         flash('Habit deleted successfully', 'success')
     except SQLAlchemyError as e:
         db.session.rollback()
@@ -370,61 +395,100 @@ def delete_habit(habit_id):
 @login_required
 def update_status(habit_id):
     habit = Habit.query.get_or_404(habit_id)
-    if habit.user_id != current_user.id:
-        abort(403)
     form = HabitStatusForm()
     if form.validate_on_submit():
-        new_log = HabitLog(
-            habit_id=habit_id,
-            date=datetime.utcnow().date(),
-            completed=form.status.data == 'completed',
-            notes=form.notes.data
-        )
-        db.session.add(new_log)
-        db.session.commit()
+        submit_write(current_user.id, 'habit_log', {
+            'habit_id': habit_id,
+            'day': datetime.utcnow().date().isoformat(),
+            'completed': form.status.data == 'completed',
+            'notes': form.notes.data
+        })
         flash('Habit status updated successfully!', 'success')
     return redirect(url_for('habit.habits'))
 
+@habit_bp.route("/habits/log", methods=['POST'])
+@login_required
+def log_habits_batch():
+    # Log many habits and/or days in one request and one transaction. Takes a JSON body
+    # ({"entries": [...]} or {"habit_ids": [...], "days": [...]}) or the form on the habits page.
+    payload = request.get_json(silent=True)
+    from_form = payload is None
+    if from_form:
+        payload = {
+            'csrf_token': request.form.get('csrf_token'),
+            'habit_ids': request.form.getlist('habit_id'),
+            'days': request.form.getlist('day'),
+            'completed': request.form.get('completed', 'y') == 'y'
+        }
+    elif not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken') or payload.get('csrf_token'))
+        except ValidationError:
+            abort(400)
+    if not sync_writes(current_user.id):
+        if from_form:
+            flash(WRITES_PENDING, 'warning')
+            return redirect(url_for('habit.habits'))
+        return jsonify({'error': WRITES_PENDING}), 503, {'Retry-After': '5'}
+
+    try:
+        entries = parse_batch_logs(payload, today=datetime.utcnow().date())
+        if len(entries) > current_app.config['MAX_BATCH_LOGS']:
+            raise ValueError(f"At most {current_app.config['MAX_BATCH_LOGS']} logs per request.")
+        count = log_habits(current_user.id, entries)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        if from_form:
+            flash(str(e), 'error')
+            return redirect(url_for('habit.habits'))
+        return jsonify({'error': str(e)}), 400
+    bump_data_version(current_user.id)
+
+    if from_form:
+        flash(f'{count} habits logged.', 'success')
+        return redirect(url_for('habit.habits'))
+    return jsonify({'logged': count})
+
 @mood_bp.route('/moods', methods=['GET', 'POST'])
+@use_reader
 @login_required
 def moods():
     form = MoodForm()
     if form.validate_on_submit():
-        new_mood = Mood(
-            date=form.date.data,
-            mood_type=MoodType[form.mood_type.data],
-            notes=form.notes.data,
-            user_id=current_user.id
-        )
-        try:
-            db.session.add(new_mood)
-            db.session.commit()
-            flash('Mood logged successfully!', 'success')
-        except IntegrityError:
-            db.session.rollback()
-            flash('Error: Mood for this date already exists.', 'error')
+        # Staged and applied in the background; the next page view of the user waits for it
+        submit_write(current_user.id, 'mood', {
+            'day': form.date.data.isoformat(),
+            'mood_type': form.mood_type.data,
+            'notes': form.notes.data
+        })
+        flash('Mood logged successfully!', 'success')
         return redirect(url_for('mood.moods'))
     
-    moods = Mood.query.order_by(Mood.date.desc()).all()
-    
-    # Prepare data for the mood chart
-    dates = [mood.date.strftime('%Y-%m-%d') for mood in moods]
-    mood_values = [list(MoodType).index(mood.mood_type) + 1 for mood in moods]
-    
-    return render_template('moods.html', form=form, moods=moods, dates=dates, mood_values=mood_values)
+    cursor, per_page = get_page_args()
+    page = keyset_paginate(Mood.query.filter_by(user_id=current_user.id),
+                           Mood.day, Mood.id, cursor, per_page)
+
+    # The chart has its own bounded query instead of reusing the listing
+    dates, mood_values = get_mood_chart(current_user.id, current_app.config['MOOD_CHART_DAYS'])
+
+    return render_template('moods.html', form=form, moods=page.items, page=page, dates=dates, mood_values=mood_values)
 
 @mood_bp.route('/moods/<int:mood_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_mood(mood_id):
     mood = Mood.query.get_or_404(mood_id)
-    if mood.user_id != current_user.id:
-        abort(403)
     form = MoodForm(obj=mood)
     if form.validate_on_submit():
+        previous_date = mood.date
         mood.date = form.date.data
         mood.mood_type = MoodType[form.mood_type.data]
         mood.notes = form.notes.data
+        refresh_mood_rollups(current_user.id, [previous_date, mood.date])
         db.session.commit()
+        bump_data_version(current_user.id)
         flash('Mood updated successfully!', 'success')
         return redirect(url_for('mood.moods'))
     return render_template('edit_mood.html', form=form, mood=mood)
@@ -433,39 +497,129 @@ def edit_mood(mood_id):
 @login_required
 def delete_mood(mood_id):
     mood = Mood.query.get_or_404(mood_id)
-    if mood.user_id != current_user.id:
-        abort(403)
     db.session.delete(mood)
+    refresh_mood_rollups(current_user.id, [mood.date])
     db.session.commit()
+    bump_data_version(current_user.id)
     flash('Mood deleted successfully!', 'success')
     return redirect(url_for('mood.moods'))
 
 @mood_bp.route('/moods/chart')
+@use_reader
 @login_required
-def moods_chart(mood_id):
-    moods = Mood.query.order_by(Mood.date()).all()
+def moods_chart():
+    try:
+        start, end, bucket, points = parse_mood_series_args(request.args)
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('mood.moods_chart'))
+    if bucket == 'raw':
+        bucket = 'auto'
+    key = cache_key('mood_series', current_user.id, start, end, bucket, points)
+    try:
+        data = cached(key, lambda: get_mood_series(current_user.id, start, end, bucket, points,
+                                                   current_app.config['MOOD_SERIES_MAX_POINTS']))
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('mood.moods_chart'))
+
+    mood_counts = Counter()
+    for item in data['series']:
+        mood_counts.update(item['counts'])
+    return render_template('moods_chart.html',
+                           dates=[item['start'] for item in data['series']],
+                           mood_values=[item['mean'] for item in data['series']],
+                           mood_types=list(mood_counts.keys()),
+                           mood_counts=list(mood_counts.values()))
 
-    dates = [mood.date.strftime('%Y-%m-%d') for mood in moods]
-    mood_values = [list(MoodType).index(mood.mood_type) + 1 for mood in moods]
+@mood_bp.route('/moods/series.json')
+@use_reader
+@login_required
+def mood_series():
+    try:
+        start, end, bucket, points = parse_mood_series_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    mood_counts = Counter(mood.mood_type.value for mood in moods)
-    mood_types = list(mood_counts.keys())
-    mood_counts = list(mood_counts.values())
+    key = cache_key('mood_series', current_user.id, start, end, bucket, points)
+    try:
+        return cached_json(key, lambda: get_mood_series(current_user.id, start, end, bucket, points,
+                                                        current_app.config['MOOD_SERIES_MAX_POINTS']))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return render_template('moods_chart.html',
-                           dates=dates,
-                           mood_values=mood_values,
-                           mood_types=mood_types,
-                           mood_counts=mood_counts)
+def _analytics_payload(user_id, start, end):
+    data = get_analytics_data(user_id, start, end)
+    data['streaks'] = get_habit_streaks(user_id)
+    data['correlations'] = get_correlations(user_id, start, end)
+    return data
 
 @analytics_bp.route("/analytics", methods=['GET', 'POST'])
+@use_reader
 @login_required
 def analytics():
-    data = get_analytics_data()
+    start, end = get_window_range()
+    key = cache_key('analytics', current_user.id, start, end, datetime.utcnow().date())
+    data = cached(key, lambda: _analytics_payload(current_user.id, start, end))
     return render_template('analytics.html', **data)
 
 @analytics_bp.route("/analytics/data")
+@use_reader
 @login_required
 def analytics_data():
-    data = get_analytics_data()
-    return jsonify(data)
\ No newline at end of file
+    try:
+        start, end = get_window_range(request.args.get('window', 'week'),
+                                      request.args.get('start'),
+                                      request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # The key only changes when the user writes something, so the ETag can be checked
+    # before any analytics work is done
+    key = cache_key('analytics', current_user.id, start, end, datetime.utcnow().date())
+    return cached_json(key, lambda: _analytics_payload(current_user.id, start, end))
+
+@analytics_bp.route("/analytics/cache")
+@login_required
+def analytics_cache():
+    return jsonify(cache_stats())
+
+@transfer_bp.route("/export.ndjson")
+@use_reader
+@login_required
+def export_data():
+    # Streamed straight from the database cursor; nothing is buffered beyond one batch
+    lines = stream_with_context(export_ndjson(current_user.id))
+    return Response(lines, mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': 'attachment; filename=waweza-export.ndjson'})
+
+@transfer_bp.route("/export/<kind>.csv")
+@use_reader
+@login_required
+def export_data_csv(kind):
+    if kind not in EXPORT_FIELDS:
+        abort(404)
+    lines = stream_with_context(export_csv(current_user.id, kind))
+    return Response(lines, mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=waweza-{kind}.csv'})
+
+@transfer_bp.route("/import", methods=['GET', 'POST'])
+@login_required
+def import_data():
+    form = ImportForm()
+    if form.validate_on_submit():
+        # Imported logs are written directly, after any staged ones
+        if not sync_writes(current_user.id):
+            flash(WRITES_PENDING, 'warning')
+            return redirect(url_for('transfer.import_data'))
+        lines = io.TextIOWrapper(form.data_file.data.stream, encoding='utf-8', errors='replace')
+        summary = import_ndjson(current_user.id, lines,
+                                progress=lambda s: current_app.logger.info(
+                                    f"Import for user {current_user.id}: {s['imported']} rows"))
+        bump_data_version(current_user.id)
+        flash(f"Imported {summary['imported']} rows, rejected {summary['rejected']}.",
+              'success' if not summary['rejected'] else 'warning')
+        for error in summary['errors']:
+            flash(error, 'warning')
+        return redirect(url_for('transfer.import_data'))
+    return render_template('import.html', title='Import Data', form=form, export_kinds=EXPORT_FIELDS)
@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+from flask import g, request, has_app_context
+from flask_login import current_user
+from sqlalchemy import event, select
+from sqlalchemy.orm import with_loader_criteria
+from waweza.storage import RoutingSession
+from waweza.models import Goal, Habit, HabitLog, Mood
+
+# Per-user tables, and the criteria that keep a user's queries to their own rows. Habit
+# logs belong to a user through their habit.
+SCOPED_CRITERIA = {
+    Goal: lambda user_id: Goal.user_id == user_id,
+    Habit: lambda user_id: Habit.user_id == user_id,
+    Mood: lambda user_id: Mood.user_id == user_id,
+    HabitLog: lambda user_id: HabitLog.habit_id.in_(select(Habit.id).where(Habit.user_id == user_id))
+}
+
+
+def scoped_user_id():
+    # The user whose rows ORM queries are limited to, or None (anonymous requests, CLI,
+    # background threads, inside unscoped())
+    if not has_app_context() or g.get('waweza_unscoped'):
+        return None
+    return g.get('waweza_scope_user_id')
+
+@contextmanager
+def unscoped():
+    # For code that works across users within a request, such as applying the staged
+    # writes of every user
+    previous = g.get('waweza_unscoped', False)
+    g.waweza_unscoped = True
+    try:
+        yield
+    finally:
+        g.waweza_unscoped = previous
+
+def _scope_to_user(execute_state):
+    # Every ORM select, including relationship lazy loads and Query.get(), gets the
+    # criteria of each scoped model it involves. A single statement can opt out with
+    # .execution_options(all_users=True).
+    if not execute_state.is_select or execute_state.execution_options.get('all_users'):
+        return
+    user_id = scoped_user_id()
+    if user_id is None:
+        return
+    # Only the models in the statement, which keeps the options (and the statement cache
+    # key) small for the common single-table query. Query.count() wraps the query in a
+    # subquery and reports no mappers, so such statements get every criterion.
+    mappers = execute_state.all_mappers
+    models = {mapper.class_ for mapper in mappers} & SCOPED_CRITERIA.keys() if mappers else SCOPED_CRITERIA.keys()
+    if models:
+        execute_state.statement = execute_state.statement.options(*[
+            with_loader_criteria(model, SCOPED_CRITERIA[model](user_id), include_aliases=True)
+            for model in models
+        ])
+
+def _set_scope():
+    # Resolved once per request, before any view query; load_user itself reads the
+    # unscoped user table
+    if request.endpoint != 'static':
+        g.waweza_scope_user_id = current_user.id if current_user.is_authenticated else None
+
+def init_app(app):
+    # The only ownership check of the views that load a row by id, so it cannot be turned off
+    if not event.contains(RoutingSession, 'do_orm_execute', _scope_to_user):
+        event.listen(RoutingSession, 'do_orm_execute', _scope_to_user)
+    app.before_request(_set_scope)
@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+from functools import wraps
+from flask import request, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.pool import QueuePool
+
+# Applied to every new SQLite connection. WAL lets readers run alongside the writer,
+# NORMAL only syncs at checkpoints, and busy_timeout makes writers wait instead of failing.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY'
+}
+# Kept in the WSGI environ rather than g, which is shared by requests under one app context
+READER_FLAG = 'waweza.db_reader'
+
+
+def _is_memory(url):
+    return url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:')
+
+def apply_sqlite_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+            cursor.close()
+
+
+class RoutingSession(SignallingSession):
+    # Sends the queries of views marked with @use_reader to the reader pool. Anything
+    # that flushes, or runs while the session holds changes, stays on the writer.
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (has_request_context() and request.environ.get(READER_FLAG) and not self._flushing
+                and not (self.new or self.dirty or self.deleted)):
+            reader = self.app.extensions['waweza_storage'].get_reader(self.app)
+            if reader is not None:
+                return reader
+        return super().get_bind(mapper, clause)
+
+
+class Database(SQLAlchemy):
+    # Flask-SQLAlchemy with the storage profile: tuned SQLite connections or sized
+    # server pools for the writer, and an optional pool of read-only connections
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        if sa_url.drivername.startswith('sqlite'):
+            if not _is_memory(sa_url):
+                # One pooled writer connection per process keeps the page cache warm and
+                # means threads queue here rather than on the database lock
+                options.setdefault('poolclass', QueuePool)
+                options.setdefault('pool_size', app.config['SQLITE_WRITER_POOL_SIZE'])
+                options.setdefault('max_overflow', 0)
+                options.setdefault('pool_timeout', app.config['DATABASE_POOL_TIMEOUT'])
+                options.setdefault('connect_args', {})['check_same_thread'] = False
+        else:
+            options.setdefault('pool_size', app.config['DATABASE_POOL_SIZE'])
+            options.setdefault('max_overflow', app.config['DATABASE_MAX_OVERFLOW'])
+            options.setdefault('pool_timeout', app.config['DATABASE_POOL_TIMEOUT'])
+            options.setdefault('pool_recycle', app.config['DATABASE_POOL_RECYCLE'])
+            options.setdefault('pool_pre_ping', True)
+        return super().apply_driver_hacks(app, sa_url, options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        pragmas = self.get_app().config['SQLITE_PRAGMAS']
+        if engine.dialect.name == 'sqlite' and pragmas:
+            apply_sqlite_pragmas(engine, pragmas)
+        return engine
+
+
+class Storage:
+    # Per-app holder of the reader engine, which is created on first use
+
+    def __init__(self):
+        self._reader = None
+        self._created = False
+        self._lock = threading.Lock()
+
+    def get_reader(self, app):
+        if not self._created:
+            with self._lock:
+                if not self._created:
+                    self._reader = self._create_reader(app)
+                    self._created = True
+        return self._reader
+
+    def _create_reader(self, app):
+        db = app.extensions['sqlalchemy'].db
+        if app.config['DATABASE_READER_URL']:
+            return create_engine(app.config['DATABASE_READER_URL'],
+                                 pool_size=app.config['DATABASE_POOL_SIZE'],
+                                 max_overflow=app.config['DATABASE_MAX_OVERFLOW'],
+                                 pool_timeout=app.config['DATABASE_POOL_TIMEOUT'],
+                                 pool_recycle=app.config['DATABASE_POOL_RECYCLE'],
+                                 pool_pre_ping=True)
+
+        # SQLite: more connections to the same file, refused any write
+        url = db.get_engine(app).url
+        if not app.config['SQLITE_READER_POOL_SIZE'] or not url.drivername.startswith('sqlite') or _is_memory(url):
+            return None
+        engine = create_engine(url, poolclass=QueuePool,
+                               pool_size=app.config['SQLITE_READER_POOL_SIZE'],
+                               max_overflow=app.config['SQLITE_READER_POOL_SIZE'],
+                               pool_timeout=app.config['DATABASE_POOL_TIMEOUT'],
+                               connect_args={'check_same_thread': False})
+        apply_sqlite_pragmas(engine, dict(app.config['SQLITE_PRAGMAS'], query_only='ON'))
+        return engine
+
+
+def use_reader(view):
+    # Marks a view whose GET requests only read, so their queries can use the reader pool
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            request.environ[READER_FLAG] = True
+        return view(*args, **kwargs)
+    return wrapped
+
+def init_app(app):
+    app.config.setdefault('SQLITE_PRAGMAS', SQLITE_PRAGMAS)
+    app.config.setdefault('SQLITE_WRITER_POOL_SIZE', 1)
+    app.config.setdefault('SQLITE_READER_POOL_SIZE', 4)
+    app.config.setdefault('DATABASE_READER_URL', None)
+    app.config.setdefault('DATABASE_POOL_SIZE', 5)
+    app.config.setdefault('DATABASE_MAX_OVERFLOW', 10)
+    app.config.setdefault('DATABASE_POOL_TIMEOUT', 30)
+    app.config.setdefault('DATABASE_POOL_RECYCLE', 1800)
+
+    # Heroku-style URLs use a scheme SQLAlchemy no longer accepts
+    for key in ('SQLALCHEMY_DATABASE_URI', 'DATABASE_READER_URL'):
+        if app.config[key] and app.config[key].startswith('postgres://'):
+            app.config[key] = 'postgresql://' + app.config[key][len('postgres://'):]
+    app.extensions['waweza_storage'] = Storage()
@@ -0,0 +1,57 @@
+import os
+import hashlib
+from flask import current_app, session
+from flask_login import current_user
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from waweza.cache import cache_key, cached
+
+
+def fragment_key(name, *parts):
+    # The user's data version is part of the key, so bump_data_version expires every
+    # fragment of the user. Fragments hold forms, so the session's CSRF secret is part of
+    # it too: a cached token is only ever sent back to the session it was made for.
+    csrf_secret = ''
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        from flask_wtf.csrf import generate_csrf
+        generate_csrf()
+        csrf_secret = session.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'), '')
+    csrf_digest = hashlib.sha1(csrf_secret.encode('utf-8')).hexdigest()[:12]
+    return cache_key('fragment', current_user.id, name, *parts, csrf_digest)
+
+
+class FragmentCacheExtension(Extension):
+    # {% cache 'name', vary1, vary2 %}...{% endcache %} renders the body once per user,
+    # data version and vary values, and serves it from the app cache until the user writes.
+    # CACHE_TTL should stay below WTF_CSRF_TIME_LIMIT so cached tokens do not expire.
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(parts)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        if not current_app.config['TEMPLATE_FRAGMENT_CACHE'] or not current_user.is_authenticated:
+            return caller()
+        return Markup(cached(fragment_key(*parts), lambda: str(caller())))
+
+
+def init_app(app):
+    app.config.setdefault('TEMPLATE_FRAGMENT_CACHE', True)
+    app.config.setdefault('TEMPLATE_BYTECODE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+    # Fragments from a per-process cache would outlive the user's writes in every other
+    # worker, so they are only cached in the shared sqlite backend
+    if app.config['CACHE_BACKEND'] != 'sqlite':
+        app.config['TEMPLATE_FRAGMENT_CACHE'] = False
+
+    # Compiled templates are kept on disk, so a new worker loads them instead of parsing
+    # every template again; entries are keyed by the template source, so edits are picked up
+    if app.config['TEMPLATE_BYTECODE_CACHE_DIR']:
+        os.makedirs(app.config['TEMPLATE_BYTECODE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_BYTECODE_CACHE_DIR'])
+    app.jinja_env.add_extension(FragmentCacheExtension)
@@ -0,0 +1,233 @@
+import csv
+import json
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from waweza import db
+from waweza.models import User, Goal, GoalType, StatusType, Habit, HabitLog, Mood, MoodType
+from waweza.rollups import rebuild_rollups
+from waweza.helpers import upsert_habit_logs
+from waweza.ingest import sync_writes
+
+EXPORT_FIELDS = {
+    'goals': ['id', 'title', 'description', 'goal_type', 'status', 'start_date', 'end_date'],
+    'habits': ['id', 'goal_id', 'name'],
+    'habit_logs': ['habit_id', 'date', 'completed', 'notes'],
+    'moods': ['date', 'mood_type', 'notes']
+}
+RECORD_TYPES = {'goals': 'goal', 'habits': 'habit', 'habit_logs': 'habit_log', 'moods': 'mood'}
+YIELD_PER = 1000
+IMPORT_CHUNK_SIZE = 5000
+
+
+def _export_rows(user_id, kind):
+    # Plain column tuples streamed with yield_per, so neither the identity map nor the
+    # result set ever holds more than one batch
+    if kind == 'goals':
+        query = db.session.query(Goal.id, Goal.title, Goal.description, Goal.type, Goal.status,
+                                 Goal.start_date, Goal.end_date).filter(Goal.user_id == user_id).order_by(Goal.id)
+        for goal_id, title, description, goal_type, status, start_date, end_date in query.yield_per(YIELD_PER):
+            yield [goal_id, title, description, goal_type.name, status.name,
+                   start_date.isoformat(), end_date.isoformat()]
+    elif kind == 'habits':
+        query = db.session.query(Habit.id, Habit.goal_id, Habit.name).filter(
+            Habit.user_id == user_id).order_by(Habit.id)
+        for row in query.yield_per(YIELD_PER):
+            yield list(row)
+    elif kind == 'habit_logs':
+        query = db.session.query(HabitLog.habit_id, HabitLog.date, HabitLog.completed, HabitLog.notes).join(
+            Habit).filter(Habit.user_id == user_id).order_by(HabitLog.id)
+        for habit_id, log_date, completed, notes in query.yield_per(YIELD_PER):
+            yield [habit_id, log_date.isoformat(), completed, notes]
+    elif kind == 'moods':
+        query = db.session.query(Mood.date, Mood.mood_type, Mood.notes).filter(
+            Mood.user_id == user_id).order_by(Mood.id)
+        for mood_date, mood_type, notes in query.yield_per(YIELD_PER):
+            yield [mood_date.isoformat(), mood_type.name, notes]
+
+def export_ndjson(user_id):
+    # Goals come before habits and habits before their logs, which is the order import needs
+    for kind, fields in EXPORT_FIELDS.items():
+        record_type = RECORD_TYPES[kind]
+        for row in _export_rows(user_id, kind):
+            record = {'type': record_type}
+            record.update(zip(fields, row))
+            yield json.dumps(record) + '\n'
+
+class _Echo:
+    def write(self, value):
+        return value
+
+def export_csv(user_id, kind):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS[kind])
+    for row in _export_rows(user_id, kind):
+        yield writer.writerow(row)
+
+
+def _text(record, field, optional=False):
+    # A string field; optional ones may also be missing or null
+    value = record.get(field)
+    if value is None and optional:
+        return None
+    if value is None:
+        raise ValueError(f'missing {field}')
+    if not isinstance(value, str):
+        raise ValueError(f'{field} must be a string')
+    return value
+
+def _datetime(record, field):
+    value = _text(record, field)
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{field} is not an ISO date: {value!r}')
+
+def _member(enum, record, field):
+    value = _text(record, field)
+    if value not in enum.__members__:
+        raise ValueError(f'unknown {field} {value!r}')
+    return enum[value]
+
+def _reference(record, field, ids):
+    # The id a record had in the export, mapped to the row imported for it
+    value = record.get(field)
+    if not isinstance(value, int) or isinstance(value, bool) or value not in ids:
+        raise ValueError(f'unknown {field} {value!r}')
+    return ids[value]
+
+def _validate(record, goal_ids, habit_ids):
+    # Returns (record_type, values) or raises ValueError with a readable message
+    if not isinstance(record, dict):
+        raise ValueError('expected a JSON object')
+    record_type = record.get('type')
+    if record_type in ('goal', 'habit') and not isinstance(record.get('id'), (int, type(None))):
+        raise ValueError('id must be a number')
+    if record_type == 'goal':
+        return record_type, {
+            'title': _text(record, 'title')[:100],
+            'description': (_text(record, 'description', optional=True) or '')[:200],
+            'type': _member(GoalType, record, 'goal_type'),
+            'status': _member(StatusType, record, 'status'),
+            'start_date': _datetime(record, 'start_date'),
+            'end_date': _datetime(record, 'end_date')
+        }
+    if record_type == 'habit':
+        return record_type, {'goal_id': _reference(record, 'goal_id', goal_ids),
+                             'name': _text(record, 'name')[:20]}
+    if record_type == 'habit_log':
+        habit_id = _reference(record, 'habit_id', habit_ids)
+        log_date = _datetime(record, 'date')
+        completed = record.get('completed', False)
+        if not isinstance(completed, bool):
+            raise ValueError('completed must be true or false')
+        return record_type, {
+            'habit_id': habit_id,
+            'date': log_date,
+            'day': log_date.date(),
+            'completed': completed,
+            'notes': _text(record, 'notes', optional=True)
+        }
+    if record_type == 'mood':
+        mood_date = _datetime(record, 'date')
+        return record_type, {
+            'mood_type': _member(MoodType, record, 'mood_type'),
+            'date': mood_date,
+            'day': mood_date.date(),
+            'notes': _text(record, 'notes', optional=True)
+        }
+    raise ValueError(f'unknown record type {record_type!r}')
+
+def import_ndjson(user_id, lines, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    # Goals and habits are few and need their new ids, so they go through the ORM.
+    # Logs and moods are written in chunks, one transaction per chunk; logs are upserted
+    # so a habit ends up with one log per day even if the file repeats a day.
+    goal_ids, habit_ids = {}, {}
+    chunks = {'habit_log': [], 'mood': []}
+    writers = {
+        'habit_log': upsert_habit_logs,
+        'mood': lambda rows: db.session.execute(Mood.__table__.insert(), rows)
+    }
+    summary = {'imported': 0, 'rejected': 0, 'errors': []}
+
+    def flush(record_type):
+        rows = chunks[record_type]
+        if rows:
+            writers[record_type](rows)
+            db.session.commit()
+            summary['imported'] += len(rows)
+            chunks[record_type] = []
+            if progress:
+                progress(summary)
+
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            record_type, values = _validate(record, goal_ids, habit_ids)
+        except ValueError as e:
+            summary['rejected'] += 1
+            if len(summary['errors']) < 20:
+                summary['errors'].append(f'line {line_number}: {e}')
+            continue
+
+        if record_type == 'goal':
+            goal = Goal(user_id=user_id, **values)
+            db.session.add(goal)
+            db.session.flush()
+            goal_ids[record.get('id')] = goal.id
+            summary['imported'] += 1
+        elif record_type == 'habit':
+            habit = Habit(user_id=user_id, **values)
+            db.session.add(habit)
+            db.session.flush()
+            habit_ids[record.get('id')] = habit.id
+            summary['imported'] += 1
+        else:
+            if record_type == 'mood':
+                values['user_id'] = user_id
+            chunks[record_type].append(values)
+            if len(chunks[record_type]) >= chunk_size:
+                flush(record_type)
+
+    flush('habit_log')
+    flush('mood')
+    db.session.commit()
+    rebuild_rollups(user_id)
+    return summary
+
+
+@click.command('export-data')
+@click.argument('user_id', type=int)
+@click.option('--format', 'export_format', type=click.Choice(['ndjson'] + list(EXPORT_FIELDS)), default='ndjson',
+              help='ndjson for everything, or the name of a table to export as CSV.')
+@click.option('--output', type=click.File('w'), default='-')
+@with_appcontext
+def export_data_command(user_id, export_format, output):
+    """Export a user's tracking data."""
+    lines = export_ndjson(user_id) if export_format == 'ndjson' else export_csv(user_id, export_format)
+    for line in lines:
+        output.write(line)
+
+@click.command('import-data')
+@click.argument('user_id', type=int)
+@click.argument('input', type=click.File('r'))
+@click.option('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+@with_appcontext
+def import_data_command(user_id, input, chunk_size):
+    """Import an NDJSON export into a user's account."""
+    if User.query.get(user_id) is None:
+        raise click.BadParameter(f'there is no user with id {user_id}')
+    if not sync_writes(user_id):
+        raise click.ClickException('staged writes of this user are still pending; run flask flush-writes')
+    summary = import_ndjson(user_id, input, chunk_size,
+                            progress=lambda s: click.echo(f"{s['imported']} rows imported", err=True))
+    for error in summary['errors']:
+        click.echo(error, err=True)
+    click.echo(f"Imported {summary['imported']} rows, rejected {summary['rejected']}.")
+
+def init_app(app):
+    app.cli.add_command(export_data_command)
+    app.cli.add_command(import_data_command)
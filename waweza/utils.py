@@ -1,24 +1,102 @@
 import os
-import secrets
-from PIL import Image
-from flask import current_app
+import hashlib
+import logging
+import tempfile
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, url_for
+
+PICTURE_SIZES = (125, 64, 32)
+PICTURE_FORMATS = {'JPEG', 'PNG'}
+
+logger = logging.getLogger(__name__)
+
+
+def _picture_folder(root_path):
+    return os.path.join(root_path, 'static/profile_pics')
 
 def save_picture(form_picture):
-    # Generate a random hex to name the picture file
-    random_hex = secrets.token_hex(8)
-    # Get the file extension of the uploaded file
-    _, f_ext = os.path.splitext(form_picture.filename)
-    # Create the new filename
-    picture_fn = random_hex + f_ext
-    # Set the path where the file will be saved
-    picture_path = os.path.join(current_app.root_path, 'static/profile_pics', picture_fn)
-
-    # Resize the image
-    output_size = (125, 125)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-
-    # Save the picture
-    i.save(picture_path)
-
-    return picture_fn
\ No newline at end of file
+    # Pillow is only needed on this path, so it is imported here rather than at startup
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = current_app.config['PROFILE_PICTURE_MAX_PIXELS']
+    # One byte past the limit is enough to reject the upload without reading all of it
+    data = form_picture.read(current_app.config['PROFILE_PICTURE_MAX_BYTES'] + 1)
+    if len(data) > current_app.config['PROFILE_PICTURE_MAX_BYTES']:
+        raise ValueError('That picture is too large.')
+
+    # Opening only parses the header, so the format and dimensions are checked
+    # before any pixels are decoded
+    try:
+        image = Image.open(BytesIO(data))
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError('That file is not a valid image.')
+    if image.format not in PICTURE_FORMATS:
+        raise ValueError('Only JPG and PNG pictures are supported.')
+    width, height = image.size
+    if width * height > current_app.config['PROFILE_PICTURE_MAX_PIXELS']:
+        raise ValueError('That picture has too many pixels.')
+
+    # Identical uploads map to the same files, so they are only processed once
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    fallback_ext = '.png' if image.mode in ('RGBA', 'LA', 'P') else '.jpg'
+    picture_fn = digest + fallback_ext
+
+    folder = _picture_folder(current_app.root_path)
+    if not os.path.exists(os.path.join(folder, f'{digest}_{PICTURE_SIZES[-1]}.webp')):
+        current_app.extensions['waweza_pictures'].submit(_process_picture, data, folder, digest, fallback_ext)
+    return picture_fn
+
+def _process_picture(data, folder, digest, fallback_ext):
+    from PIL import Image, ImageOps
+    try:
+        image = Image.open(BytesIO(data))
+        # JPEG can decode straight at a reduced scale; other formats use reduce() in thumbnail()
+        image.draft('RGB', (PICTURE_SIZES[0] * 2, PICTURE_SIZES[0] * 2))
+        image = ImageOps.exif_transpose(image)
+        if fallback_ext == '.jpg':
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+
+        # Each size is made from the previous one; the smallest is written last and marks completion
+        for size in PICTURE_SIZES:
+            image.thumbnail((size, size), reducing_gap=2.0)
+            for ext, options in (('.webp', {'quality': 80, 'method': 4}),
+                                 (fallback_ext, {'quality': 85, 'optimize': True})):
+                path = os.path.join(folder, f'{digest}_{size}{ext}')
+                # A name of its own, as the same upload can be processed twice at once
+                fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=f'.{digest}_{size}', suffix=ext + '.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        image.save(f, format=Image.registered_extensions()[ext], **options)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    os.remove(tmp_path)
+                    raise
+    except Exception:
+        logger.exception('Processing profile picture %s failed', digest)
+
+def profile_picture(image_file, size=PICTURE_SIZES[0]):
+    # URLs of the picture variant closest to `size`: a WebP source and a fallback image.
+    # Pictures uploaded before the pipeline existed, or still being processed, only have a fallback.
+    folder = _picture_folder(current_app.root_path)
+    if image_file:
+        stem, ext = os.path.splitext(image_file)
+        variant = min((s for s in PICTURE_SIZES if s >= size), default=PICTURE_SIZES[0])
+        if os.path.exists(os.path.join(folder, f'{stem}_{PICTURE_SIZES[-1]}.webp')):
+            return {
+                'webp': url_for('static', filename=f'profile_pics/{stem}_{variant}.webp'),
+                'fallback': url_for('static', filename=f'profile_pics/{stem}_{variant}{ext}')
+            }
+        if os.path.exists(os.path.join(folder, image_file)):
+            return {'webp': None, 'fallback': url_for('static', filename='profile_pics/' + image_file)}
+    return {'webp': None, 'fallback': url_for('static', filename='profile_pics/default-avatar.png')}
+
+def init_app(app):
+    app.config.setdefault('PROFILE_PICTURE_MAX_BYTES', 5 * 1024 * 1024)
+    app.config.setdefault('PROFILE_PICTURE_MAX_PIXELS', 40_000_000)
+    app.config.setdefault('PROFILE_PICTURE_WORKERS', 2)
+    # One pool per app, so pictures are processed by the app that received them
+    app.extensions['waweza_pictures'] = ThreadPoolExecutor(max_workers=app.config['PROFILE_PICTURE_WORKERS'],
+                                                           thread_name_prefix='pictures')
+    app.add_template_global(profile_picture)